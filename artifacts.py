@@ -0,0 +1,115 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+# Where expensive stage outputs are kept between jobs on this node
+ARTIFACT_CACHE_DIR = os.environ.get("ARTIFACT_CACHE_DIR", "artifact_cache")
+# Size the cache is trimmed back to, least recently used artifacts go first
+ARTIFACT_CACHE_MB = float(os.environ.get("ARTIFACT_CACHE_MB", 5000))
+
+
+def hash_file(path: str) -> str:
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_bytes(data) -> str:
+    """SHA-256 of a bytes-like object, e.g. a NumPy array."""
+    return hashlib.sha256(memoryview(data).cast("B")).hexdigest()
+
+
+def artifact_key(*parts) -> str:
+    """Key for an artifact derived from its inputs, e.g. artifact_key("stems", audio_hash)."""
+    return hashlib.sha256("\0".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+def link_or_copy(src: str, dst: str):
+    """Hard link src to dst, copying if they're on different file systems. Replaces dst."""
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        os.remove(dst)
+        link_or_copy(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class ArtifactCache:
+    """
+    Node-local cache of stage outputs shared by every job and worker process, keyed by a hash of what each output
+    was made from: the downloaded audio for the stems, the vocals and Whisper settings for the transcription,
+    and the lyrics and transcription for the alignment. So a retry, a re-request, or another track that turns out
+    to be the same recording skips the stages it already went through.
+
+    Artifacts are files written under a temporary name and renamed into place, so a reader never sees half an
+    artifact. They're handed out as hard links, so an artifact evicted while a job uses it stays readable.
+    Once the cache grows past max_bytes the least recently used artifacts are deleted.
+    """
+
+    def __init__(self, root: str = ARTIFACT_CACHE_DIR, max_bytes: float = ARTIFACT_CACHE_MB * 1e6):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def path(self, key: str, name: str) -> str:
+        return os.path.join(self.root, key[:2], key + "-" + name)
+
+    def get(self, key: str, name: str, dst: str) -> bool:
+        """Link the artifact to dst and return True if it's cached, otherwise return False."""
+        path = self.path(key, name)
+        try:
+            link_or_copy(path, dst)
+        except FileNotFoundError:
+            return False
+
+        # Modification time is the last use, it's what eviction goes by
+        os.utime(path)
+        print("Artifact cache hit for " + name)
+        return True
+
+    def put(self, key: str, name: str, src: str):
+        """Add the file at src to the cache, then trim the cache if it has grown too big."""
+        path = self.path(key, name)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        try:
+            link_or_copy(src, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """Delete the least recently used artifacts until the cache is within max_bytes."""
+        with self.lock:
+            entries = []
+            for entry in Path(self.root).glob("*/*"):
+                # Still being written by put
+                if entry.suffix == ".tmp":
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in sorted(entries, key=lambda entry: entry[0]):
+                if total <= self.max_bytes:
+                    break
+                entry.unlink(missing_ok=True)
+                total -= size
+
+
+artifacts = ArtifactCache()
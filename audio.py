@@ -0,0 +1,67 @@
+import os
+import subprocess
+from typing import NamedTuple, Optional, Union
+
+
+class AudioFormat(NamedTuple):
+    """
+    How the karaoke track is stored: the ffmpeg encoder (None keeps Spleeter's WAV as it is),
+    a container ffmpeg can write to a pipe, and the content type and file extension it's served with.
+    """
+
+    codec: Optional[str]
+    container: str
+    content_type: str
+    extension: str
+
+
+AUDIO_FORMATS = {
+    "wav": AudioFormat(None, "wav", "audio/wav", "wav"),
+    "mp3": AudioFormat("libmp3lame", "mp3", "audio/mpeg", "mp3"),
+    # ADTS rather than MP4, which needs a seekable output to write its index
+    "aac": AudioFormat("aac", "adts", "audio/aac", "aac"),
+    "opus": AudioFormat("libopus", "ogg", "audio/ogg", "ogg"),
+}
+
+# Format of the uploaded karaoke track, one of AUDIO_FORMATS
+KARAOKE_FORMAT = os.environ.get("KARAOKE_FORMAT", "mp3")
+# Bitrate passed to the encoder, ignored for WAV
+KARAOKE_BITRATE = os.environ.get("KARAOKE_BITRATE", "192k")
+
+
+def get_audio_format(audio_format: Optional[Union[str, AudioFormat]] = None) -> AudioFormat:
+    """Resolve a format by name, defaulting to KARAOKE_FORMAT."""
+    if isinstance(audio_format, AudioFormat):
+        return audio_format
+
+    return AUDIO_FORMATS[audio_format or KARAOKE_FORMAT]
+
+
+def encode(wav_path: str, audio_format: AudioFormat, bitrate: str = KARAOKE_BITRATE) -> subprocess.Popen:
+    """
+    Start ffmpeg encoding wav_path. The encoded audio streams out of the process' stdout as it's produced,
+    so it can be uploaded without ever being written to disk.
+    """
+    return subprocess.Popen(
+        [
+            "ffmpeg", "-nostdin", "-loglevel", "error",
+            "-i", wav_path,
+            "-vn", "-c:a", audio_format.codec, "-b:a", bitrate,
+            "-f", audio_format.container, "pipe:1",
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+
+class CountingReader:
+    """Wraps a file object to count the bytes read through it."""
+
+    def __init__(self, f):
+        self.f = f
+        self.bytes_read = 0
+
+    def read(self, size=-1) -> bytes:
+        data = self.f.read(size)
+        self.bytes_read += len(data)
+        return data
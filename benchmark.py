@@ -0,0 +1,391 @@
+import argparse
+import os
+import re
+import resource
+import subprocess
+import sys
+import time
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB (ru_maxrss is KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_isolated(code: str) -> str:
+    """Run a snippet in a fresh interpreter so import costs aren't hidden by module caching."""
+    return subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+
+def bench_cmudict():
+    """Import time, first lookup time and peak RSS of the CMU dictionary, cold vs. cached."""
+    code = """
+import time, resource
+start = time.perf_counter()
+from syllabify.cmuparser3 import cmudict
+imported = time.perf_counter()
+cmudict["linguistics"]
+looked_up = time.perf_counter()
+print("import {:.3f}s, first lookup {:.3f}s, peak RSS {:.1f} MB".format(
+    imported - start, looked_up - imported, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+"""
+    prelude = "from syllabify.cmuparser3 import cmudict; import os\n"
+    prelude += "os.path.exists(cmudict.path_to_cache) and os.remove(cmudict.path_to_cache)\n"
+
+    run_isolated(prelude)
+    print("cmudict (no cache):  " + run_isolated(code))
+    print("cmudict (cached):    " + run_isolated(code))
+
+
+def bench_match_table():
+    """Python vs. NumPy fill of the word alignment table, for a typical line and for a very long one."""
+    import random
+    from match_words import fill_match_table, fill_match_table_numpy, make_timeline
+
+    rng = random.Random(0)
+    vocab = ["oh", "baby", "love", "singing", "singin'", "tonight", "I", "you", "go", "tomorrow"]
+
+    for m_len, w_len, repeats in [(10, 12, 200), (150, 160, 3)]:
+        m_line = make_timeline([rng.choice(vocab) for _ in range(m_len)], [0] * m_len, [0] * m_len)
+        w_line = make_timeline([rng.choice(vocab) for _ in range(w_len)], [0] * w_len, [0] * w_len)
+
+        for fill in (fill_match_table, fill_match_table_numpy):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                fill(m_line.ids, m_line.syllables, w_line.ids, w_line.syllables, 0, 0)
+            elapsed = (time.perf_counter() - start) / repeats
+            print("{} {}x{}: {:.3f} ms".format(fill.__name__, m_len, w_len, elapsed * 1000))
+
+
+WHISPER_CODE = """
+import sys, time, resource
+from scripts import get_whisper
+from match_words import get_karaoke_lines
+start = time.perf_counter()
+whisper_path = get_whisper(sys.argv[1], sys.argv[2], sys.argv[3])
+wall = time.perf_counter() - start
+peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+# Logs how many lyric words the karaoke lines matched to the transcription
+get_karaoke_lines(sys.argv[4], whisper_path, sys.argv[2])
+print("RESULT wall {:.1f}s, peak RSS {:.0f} MB".format(wall, peak_rss))
+"""
+MATCHED = re.compile(r"Matched (\d+) of (\d+) lyric words")
+
+
+def run_whisper(args, profile: str, env: dict = None) -> str:
+    """
+    Run get_whisper on --vocals in a fresh process and return its wall time, peak RSS and matched-word ratio.
+    The ratio is the one get_karaoke_lines gets aligning the lyrics line by line, as the service does.
+    Every run gets an empty artifact cache, so it times the transcription rather than a cache hit.
+    """
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as lyrics_dir:
+        output = subprocess.run(
+            [sys.executable, "-c", WHISPER_CODE, args.vocals, lyrics_dir, profile, args.musixmatch],
+            capture_output=True,
+            text=True,
+            env={**os.environ, "ARTIFACT_CACHE_DIR": os.path.join(lyrics_dir, "artifact_cache"), **(env or {})},
+        )
+    results = [line for line in output.stdout.splitlines() if line.startswith("RESULT")]
+    matched = MATCHED.search(output.stdout)
+    if not results or matched is None:
+        return "failed\n" + output.stderr[-2000:]
+    ratio = int(matched[1]) / max(int(matched[2]), 1)
+    return "{}, matched words {:.1%}".format(results[0][len("RESULT "):], ratio)
+
+
+def bench_whisper_profiles(args):
+    """
+    Wall time, peak RSS and matched-word ratio of get_whisper for every profile, each in a fresh process.
+    Needs a separated vocals file and the song's musixmatch json.
+    """
+    if args.vocals is None or args.musixmatch is None:
+        print("whisper_profiles needs --vocals and --musixmatch, skipping")
+        return
+
+    from models import WHISPER_PROFILES
+
+    for name in args.profiles or WHISPER_PROFILES:
+        print("{}: {}".format(name, run_whisper(args, name)))
+
+
+def bench_vad(args):
+    """
+    get_whisper transcribing the whole vocal stem vs. only the sung regions found by the energy gate,
+    to check the time saved doesn't cost matched words. Needs --vocals and --musixmatch like whisper_profiles.
+    """
+    if args.vocals is None or args.musixmatch is None:
+        print("vad needs --vocals and --musixmatch, skipping")
+        return
+
+    profile = args.profiles[0] if args.profiles else "cpu-fast"
+    for gate in ("0", "1"):
+        print("{}, {}: {}".format(profile, "gated" if gate == "1" else "whole stem", run_whisper(args, profile, {"VAD_GATE": gate})))
+
+
+def write_test_song(path: str, seconds: float):
+    """Write a stereo 44.1 kHz WAV of a chord with a pulsing melody, long enough to stand in for a song."""
+    import wave
+    import numpy as np
+
+    with wave.open(path, "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(44100)
+
+        # Written a second at a time so long test songs don't need much memory either
+        for second in range(int(seconds)):
+            t = second + np.arange(44100) / 44100
+            chord = sum(np.sin(2 * np.pi * freq * t) for freq in (110, 165, 220)) / 6
+            melody = np.sin(2 * np.pi * 440 * t * (1 + 0.1 * np.sin(t))) * (np.sin(np.pi * t) ** 2) / 3
+            samples = np.stack([chord + melody, chord - melody / 2], axis=1)
+            f.writeframes((samples * 32767).astype("<i2").tobytes())
+
+
+def bench_separation(args):
+    """Wall time and peak RSS of Spleeter separating the whole song at once vs. in chunks, by song length."""
+    import tempfile
+
+    code = """
+import sys, time, resource
+from spleeter.separator import Separator
+from separation import StemWriter, get_duration, separate_chunked
+song, out_dir, chunk_seconds = sys.argv[1], sys.argv[2], float(sys.argv[3])
+separator = Separator("spleeter:2stems")
+start = time.perf_counter()
+if chunk_seconds == 0:
+    separator.separate_to_file(song, out_dir, duration=get_duration(song))
+else:
+    stems = {stem: StemWriter(out_dir + "/" + stem + ".wav") for stem in ("vocals", "accompaniment")}
+    separate_chunked(separator, song, stems, chunk_seconds)
+print("RESULT wall {:.1f}s, peak RSS {:.0f} MB".format(
+    time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+"""
+
+    for seconds in args.durations:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            song = os.path.join(tmp_dir, "song.wav")
+            write_test_song(song, seconds)
+
+            for chunk_seconds in (0, args.chunk_seconds):
+                output = subprocess.run(
+                    [sys.executable, "-c", code, song, tmp_dir, str(chunk_seconds)], capture_output=True, text=True
+                )
+                results = [line for line in output.stdout.splitlines() if line.startswith("RESULT")]
+                mode = "whole song" if chunk_seconds == 0 else "{:g}s chunks".format(chunk_seconds)
+                print("{:g}s song, {}: {}".format(
+                    seconds, mode, results[0][len("RESULT "):] if results else "failed\n" + output.stderr[-2000:]
+                ))
+
+
+class CannedVideo:
+    """Stand-in for a pytube YouTube search result whose length takes a network round trip to read."""
+
+    def __init__(self, length: int, latency: float):
+        self._length = length
+        self.latency = latency
+
+    @property
+    def length(self) -> int:
+        time.sleep(self.latency)
+        return self._length
+
+
+def bench_youtube_search(args):
+    """Time to find the matching search result, looking up one result at a time vs. several at once, offline."""
+    from youtube import find_video
+
+    latency = args.latency
+    # The song's video is the 8th of 20 results, the ones before it are covers and live versions
+    results = [CannedVideo(200 + 30 * (i + 1), latency) for i in range(7)] + [CannedVideo(200, latency)]
+    results += [CannedVideo(200 + i, latency) for i in range(12)]
+
+    for workers in (1, 4, 8):
+        start = time.perf_counter()
+        video = find_video("song", 200, search=lambda query: results, workers=workers)
+        assert video is results[7]
+        print("{} workers: {:.2f}s".format(workers, time.perf_counter() - start))
+
+
+def serve_fixture(data: bytes, bytes_per_second: float, fail_every: int = 0):
+    """
+    Local HTTP stand-in for a video host: serves data with range request support, throttling every connection
+    to bytes_per_second like YouTube does. If fail_every is set, every fail_every-th request is cut off halfway.
+    Returns the server, running on a background thread, and the URL of the data.
+    """
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    requests_served = [0]
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_served[0] += 1
+            fail = fail_every and requests_served[0] % fail_every == 0
+
+            start, end = 0, len(data) - 1
+            if "Range" in self.headers:
+                first, last = self.headers["Range"][len("bytes="):].split("-")
+                start, end = int(first), min(int(last or end), end)
+                self.send_response(206)
+                self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, len(data)))
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(end + 1 - start))
+            self.end_headers()
+
+            stop = start + (end + 1 - start) // 2 if fail else end + 1
+            for position in range(start, stop, 1 << 16):
+                block = data[position:min(position + (1 << 16), stop)]
+                self.wfile.write(block)
+                time.sleep(len(block) / bytes_per_second)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}/audio".format(server.server_port)
+
+
+def bench_download():
+    """Downloading a fixture from a local throttled server in one request vs. parallel range requests, with and without dropped connections."""
+    import tempfile
+    from youtube import download_ranges
+
+    data = os.urandom(8 * 1024 * 1024)
+
+    for fail_every in (0, 3):
+        server, url = serve_fixture(data, 4 * 1024 * 1024, fail_every)
+
+        for parts in (1, 4, 8):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = os.path.join(tmp_dir, "audio")
+                start = time.perf_counter()
+                download_ranges(url, path, len(data), parts)
+                elapsed = time.perf_counter() - start
+
+                with open(path, "rb") as f:
+                    intact = f.read() == data
+            print("{} parts{}: {:.2f}s, {}".format(
+                parts, ", every 3rd request dropped" if fail_every else "", elapsed, "intact" if intact else "CORRUPT"
+            ))
+
+        server.shutdown()
+
+
+def bench_lyrics():
+    """
+    Lyrics client against a local stand-in for the lyrics API with 50 ms latency: fetching 20 tracks with the
+    pooled session, fetching them again from the cache, through a flaky server, and for a track without lyrics.
+    """
+    import json
+    import tempfile
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+    from lyrics import LyricsClient, LyricsNotFound
+
+    requests_served = [0]
+
+    class Handler(BaseHTTPRequestHandler):
+        # Keep connections open, like the real API, so the session can reuse them
+        protocol_version = "HTTP/1.1"
+        fail_every = 0
+
+        def do_GET(self):
+            requests_served[0] += 1
+            time.sleep(0.05)
+            track_id = parse_qs(urlparse(self.path).query)["trackid"][0]
+
+            if self.fail_every and requests_served[0] % self.fail_every == 0:
+                status, body = 503, {"error": True, "message": "unavailable"}
+            elif track_id == "missing":
+                status, body = 404, {"error": True, "message": "lyrics for this track is not available on spotify!"}
+            else:
+                status, body = 200, {"error": False, "syncType": "LINE_SYNCED", "lines": [
+                    {"startTimeMs": "1000", "words": "lyrics of " + track_id, "syllables": [], "endTimeMs": "0"}
+                ]}
+
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}/".format(server.server_port)
+    track_ids = ["track{}".format(i) for i in range(20)]
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        client = LyricsClient(url, cache_dir)
+
+        for label in ("fetched", "cached"):
+            served = requests_served[0]
+            start = time.perf_counter()
+            for track_id in track_ids:
+                client.get(track_id)
+            print("20 tracks {}: {:.2f}s, {} requests".format(label, time.perf_counter() - start, requests_served[0] - served))
+
+        Handler.fail_every = 3
+        flaky = LyricsClient(url, cache_dir + "/flaky")
+        start = time.perf_counter()
+        for track_id in track_ids:
+            assert flaky.get(track_id)["lines"][0]["words"] == "lyrics of " + track_id
+        print("20 tracks, every 3rd request failing: {:.2f}s".format(time.perf_counter() - start))
+        Handler.fail_every = 0
+
+        for attempt in range(2):
+            served = requests_served[0]
+            try:
+                client.get("missing")
+            except LyricsNotFound:
+                print("track without lyrics, attempt {}: not found, {} requests".format(attempt + 1, requests_served[0] - served))
+
+    server.shutdown()
+
+
+BENCHMARKS = {
+    "cmudict": bench_cmudict,
+    "match_table": bench_match_table,
+    "whisper_profiles": bench_whisper_profiles,
+    "separation": bench_separation,
+    "vad": bench_vad,
+    "youtube_search": bench_youtube_search,
+    "download": bench_download,
+    "lyrics": bench_lyrics,
+}
+
+# Benchmarks that need the command line arguments
+NEEDS_ARGS = {"whisper_profiles", "separation", "vad", "youtube_search"}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the karaoke generation pipeline.")
+    parser.add_argument("benchmarks", nargs="*", help="benchmarks to run, all by default: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--vocals", help="separated vocals audio file for whisper_profiles and vad")
+    parser.add_argument("--musixmatch", help="musixmatch json of the same song for whisper_profiles and vad")
+    parser.add_argument("--profiles", nargs="+", help="whisper profiles to compare, all by default (vad uses the first, cpu-fast by default)")
+    parser.add_argument("--durations", type=float, nargs="+", default=[60, 240, 900],
+                        help="song lengths in seconds for separation")
+    parser.add_argument("--chunk-seconds", type=float, default=60, help="window length for chunked separation")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per simulated network request")
+    args = parser.parse_args()
+
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark " + name)
+
+    for name in args.benchmarks or BENCHMARKS:
+        start = time.perf_counter()
+        BENCHMARKS[name](args) if name in NEEDS_ARGS else BENCHMARKS[name]()
+        print("{} took {:.2f}s (peak RSS {:.1f} MB)\n".format(name, time.perf_counter() - start, peak_rss_mb()))
@@ -0,0 +1,121 @@
+import json
+import os
+import random
+import time
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from manifest import write_json_atomic
+
+LYRICS_API_URL = os.environ.get("LYRICS_API_URL", "https://spotify-lyric-api-984e7b4face0.herokuapp.com/")
+# Where fetched lyrics are kept between jobs, keyed by Spotify track ID
+LYRICS_CACHE_DIR = os.environ.get("LYRICS_CACHE_DIR", "lyrics_cache")
+# Seconds fetched lyrics are reused for
+LYRICS_CACHE_TTL = float(os.environ.get("LYRICS_CACHE_TTL", 7 * 24 * 3600))
+# Seconds a track without synced lyrics is remembered as such, shorter since lyrics get added over time
+LYRICS_NEGATIVE_TTL = float(os.environ.get("LYRICS_NEGATIVE_TTL", 24 * 3600))
+# Seconds to wait to connect to the lyrics API, and for it to respond
+LYRICS_TIMEOUT = (3.05, float(os.environ.get("LYRICS_TIMEOUT", 15)))
+# Times a failed request is retried, waiting a random time of up to LYRICS_BACKOFF * 2^attempt seconds in between
+LYRICS_RETRIES = int(os.environ.get("LYRICS_RETRIES", 3))
+LYRICS_BACKOFF = 0.5
+
+# Responses worth retrying, the rest are answers
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LyricsNotFound(Exception):
+    """The track has no line synced lyrics to align to."""
+
+
+class LyricsClient:
+    """
+    Fetches a track's synced lyrics from the lyrics API. Requests share one pooled session with timeouts,
+    and failures are retried with jittered exponential backoff. Responses are cached on disk by track ID
+    for ttl seconds, and tracks without synced lyrics for negative_ttl seconds.
+    """
+
+    def __init__(
+        self,
+        url: str = LYRICS_API_URL,
+        cache_dir: str = LYRICS_CACHE_DIR,
+        ttl: float = LYRICS_CACHE_TTL,
+        negative_ttl: float = LYRICS_NEGATIVE_TTL,
+        timeout=LYRICS_TIMEOUT,
+        retries: int = LYRICS_RETRIES,
+    ):
+        self.url = url
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.retries = retries
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=16)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def cache_path(self, track_id: str) -> str:
+        return os.path.join(self.cache_dir, track_id + ".json")
+
+    def read_cache(self, track_id: str):
+        """The cached entry for track_id if it hasn't expired, otherwise None."""
+        try:
+            with open(self.cache_path(track_id), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        ttl = self.ttl if entry["lyrics"] is not None else self.negative_ttl
+        return entry if time.time() - entry["fetched"] < ttl else None
+
+    def write_cache(self, track_id: str, lyrics):
+        Path(self.cache_dir).mkdir(parents=True, exist_ok=True)
+        write_json_atomic(self.cache_path(track_id), {"fetched": time.time(), "lyrics": lyrics})
+
+    def request(self, track_id: str) -> requests.Response:
+        for attempt in range(self.retries + 1):
+            try:
+                res = self.session.get(self.url, params={"trackid": track_id}, timeout=self.timeout)
+                if res.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return res
+                reason = "status " + str(res.status_code)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                reason = str(e)
+
+            delay = random.uniform(0, LYRICS_BACKOFF * 2 ** attempt)
+            print("Lyrics request for {} failed ({}), retrying in {:.1f}s".format(track_id, reason, delay))
+            time.sleep(delay)
+
+    def get(self, track_id: str) -> dict:
+        """The track's lyrics as the API returns them. Raises LyricsNotFound if it has no synced lyrics."""
+        entry = self.read_cache(track_id)
+        if entry is None:
+            res = self.request(track_id)
+
+            # The API answers with an error for tracks it has no lyrics for, and unsynced lyrics have no timestamps
+            if res.status_code == 404:
+                lyrics = None
+            else:
+                res.raise_for_status()
+                lyrics = res.json()
+                if lyrics.get("error") or lyrics.get("syncType") == "UNSYNCED":
+                    lyrics = None
+
+            self.write_cache(track_id, lyrics)
+            entry = {"lyrics": lyrics}
+        else:
+            print("Lyrics for " + track_id + " found in cache")
+
+        if entry["lyrics"] is None:
+            raise LyricsNotFound("No synced lyrics for track " + track_id)
+
+        return entry["lyrics"]
+
+
+lyrics_client = LyricsClient()
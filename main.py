@@ -3,13 +3,12 @@ from pathlib import Path
 import os
 import shutil
 import torch
-import json
 
-from scripts import get_title, download_and_split, get_musixmatch, get_whisper
-from match_words import get_karaoke_lines
+from scripts import get_title, download, split, get_musixmatch, get_whisper, align_lyrics, warm_up_workers, WHISPER_MODE
 
 import asyncio
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from workers import SingleFlight, Workers
 
 from gql import Client, gql
 from gql.transport.websockets import WebsocketsTransport
@@ -19,6 +18,11 @@ from gql.transport.aiohttp import AIOHTTPTransport
 from gql.transport.appsync_auth import AppSyncApiKeyAuthentication
 
 import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+from audio import get_audio_format
+from storage import find_existing_karaoke, upload_karaoke
+from manifest import JobManifest, hash_output, run_and_hash
 
 # Uncomment these lines when using as a one off function called on command line (as opposed to a server)
 
@@ -56,29 +60,33 @@ mutation AddKaraoke($id: String!, $lyrics: AWSJSON!, $url: String!) {
 }
 """)
 
-def get_karaoke(name: str,
+async def get_karaoke(workers: Workers,
+    name: str,
     artists: list[str],
     length: int,
     spotify_id: str,
-    MAX_TIME_DIF: int = 2) -> (str, str):
-    """Returns S3 key of the lyrics JSON and the URL to the karaoke wav file."""
+    MAX_TIME_DIF: int = 2,
+    whisper_profile: str = None) -> (str, str, str):
+    """Returns S3 key of the lyrics JSON, the URL to the karaoke track, and the lyrics JSON itself.
+    Each stage runs in the workers' pools, so other requests are served while this one waits.
+    whisper_profile names a models.WHISPER_PROFILES entry to use instead of the configured one."""
 
     lyrics_key = spotify_id + "/lyrics.json"
-    track_key = spotify_id + "/track.wav"
+    track_key = spotify_id + "/track." + get_audio_format().extension
+    # Tracks generated before KARAOKE_FORMAT were uploaded as WAV, they're still served rather than made again
+    legacy_track_key = spotify_id + "/track.wav"
 
     # Check if the files already exist first, if so return them
-    
-    try: 
-        print("Looking for existing files on S3...")
-        S3.get_object(Bucket=BUCKET, Key=lyrics_key)
-        S3.get_object(Bucket=BUCKET, Key=track_key)
-
-        track_url = S3.generate_presigned_url("get_object", Params={"Bucket": BUCKET, "Key": track_key}, ExpiresIn=3600)
-
-        return lyrics_key, track_url
-    except Exception as e:
-        print(e)
-        pass
+    try:
+        existing = await workers.run(
+            "lookup", find_existing_karaoke, S3, BUCKET, lyrics_key, track_key, [legacy_track_key]
+        )
+        if existing is not None:
+            track_url, lyrics = existing
+            return lyrics_key, track_url, lyrics
+    except (BotoCoreError, ClientError) as e:
+        # Couldn't tell whether the track exists, generating it again is slower but still correct
+        print("S3 lookup failed, generating karaoke anyway:", e)
 
     title = get_title(name, artists)
     
@@ -93,41 +101,60 @@ def get_karaoke(name: str,
     lyrics_dir = os.path.join(spotify_id, "lyrics", title)
     Path(lyrics_dir).mkdir(parents=True, exist_ok=True)
 
-    print("Downloading from YouTube and splitting...")
-    vocals, karaoke_track = download_and_split(title, length, pytube_dir, spleeter_dir)
-    musixmatch = get_musixmatch(spotify_id, lyrics_dir)
-    whisper = get_whisper(vocals, lyrics_dir)
-
-    lyrics_json = get_karaoke_lines(musixmatch, whisper, lyrics_dir)
-
-    print("Uploading lyric and karaoke track files...")
-    # Upload voiceless accompaniment track and timestamped lyrics to S3
-    S3.upload_file(lyrics_json, BUCKET, lyrics_key)
-    S3.upload_file(karaoke_track, BUCKET, track_key)
-
-    track_url = S3.generate_presigned_url("get_object", Params={"Bucket": BUCKET, "Key": track_key}, ExpiresIn=3600)
+    # Stages that already finished before a crash or restart are picked up from the manifest instead of run again
+    manifest = JobManifest(spotify_id)
+
+    async def run_stage(stage: str, func, *args) -> str:
+        path = manifest.recorded(stage)
+        if path is not None:
+            path = manifest.completed(stage, await workers.run("lookup", hash_output, path))
+        if path is None:
+            path, sha256 = await workers.run(stage, run_and_hash, func, *args)
+            if path is not None:
+                manifest.record(stage, path, sha256)
+        return path
+
+    # The lyrics only need the track ID, fetch them while the audio is processed
+    get_lyrics = asyncio.ensure_future(run_stage("lyrics", get_musixmatch, spotify_id, lyrics_dir))
+
+    async def get_audio():
+        print("Downloading from YouTube...")
+        song_path = await run_stage("download", download, title, length, pytube_dir, MAX_TIME_DIF)
+        if song_path is None:
+            raise ValueError("No YouTube video found for " + title)
+        # Separation isn't recorded, its output goes to the artifact cache, which makes running it again cheap
+        vocals, karaoke_track = await workers.run("separate", split, song_path, title, spleeter_dir)
+        # Forced alignment needs the lyrics before it can start
+        musixmatch = await get_lyrics if WHISPER_MODE == "lyrics" else None
+        whisper = await run_stage("transcribe", get_whisper, vocals, lyrics_dir, whisper_profile, musixmatch)
+        return karaoke_track, whisper
+
+    (karaoke_track, whisper), musixmatch = await asyncio.gather(get_audio(), get_lyrics)
+
+    lyrics_json = await run_stage("align", align_lyrics, musixmatch, whisper, lyrics_dir)
+
+    track_url, lyrics = await workers.run(
+        "upload", upload_karaoke, S3, BUCKET, lyrics_json, karaoke_track, lyrics_key, track_key
+    )
     # Delete temporary directory
     shutil.rmtree(spotify_id)
     print("Deleting temporary directory " + spotify_id + "...")
     
-    return lyrics_key, track_url
+    return lyrics_key, track_url, lyrics
 
 
-async def add_karaoke_mutation(http_session, req):
+# Requests for a track that's already being processed wait for that run instead of starting another
+karaoke_flights = SingleFlight()
+
+
+async def add_karaoke_mutation(workers: Workers, http_session, req):
     # Save temporary files for song in a folder in the container named after the unique spotify track ID
-    # lyrics_key, karaoke_url = await loop.run_in_executor(p, get_karaoke, req["name"], req["artists"], req["duration"], req["id"])
-    lyrics_key, karaoke_url = get_karaoke(req["name"], req["artists"], req["duration"], req["id"])
-
-    local_lyrics_file = req["id"] + ".json"
-    print("Downloading lyrics json...")
-    S3.download_file(BUCKET, lyrics_key, local_lyrics_file)
-    with open(local_lyrics_file, "r") as f:
-        lyrics_json = json.load(f)
-
-    lyrics_json_string = json.dumps(lyrics_json)
-    # delete temporary lyrics file
-    os.remove(local_lyrics_file)
-    mutation_vars = {"id": req["id"], "lyrics": lyrics_json_string, "url": karaoke_url}
+    lyrics_key, karaoke_url, lyrics = await karaoke_flights.do(
+        req["id"], lambda: get_karaoke(workers, req["name"], req["artists"], req["duration"], req["id"])
+    )
+
+    # The lyrics are already JSON, send them as they are
+    mutation_vars = {"id": req["id"], "lyrics": lyrics, "url": karaoke_url}
     
     print("Sending karaoke with id " + str(mutation_vars["id"]))
     result = await http_session.execute(MUTATION, variable_values=mutation_vars)
@@ -135,6 +162,11 @@ async def add_karaoke_mutation(http_session, req):
     return result
 
 
+def report_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        print("Karaoke request failed:", repr(task.exception()))
+
+
 async def main():
     API_URL = "https://rn742wctergrveqhvgxo6tg7na.appsync-api.us-east-1.amazonaws.com/graphql"
     WS_URL = API_URL.replace("https://", "ws://").replace("/graphql", "")
@@ -144,29 +176,50 @@ async def main():
         print("CUDA device detected, ignoring TF warnings about AVX...")
         os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
+    # Every worker process loads the Spleeter and WhisperX models once when it starts, every request it runs reuses them
+    print("Starting workers...")
+    workers = Workers(initializer=warm_up_workers)
+    try:
+        workers.start()
+    except BrokenProcessPool:
+        # e.g. an unknown WHISPER_PROFILE, every request would fail the same way
+        print("Worker processes failed to load their models, exiting")
+        workers.shutdown()
+        raise SystemExit(1)
+    print("Workers ready")
+    # Keep a reference to running requests so they aren't garbage collected mid-flight
+    tasks = set()
+
     # realtime_transport = WebsocketsTransport(url=WS_URL)
     realtime_transport = AppSyncWebsocketsTransport(url=API_URL)
     http_transport = AIOHTTPTransport(url=API_URL, auth=realtime_transport.auth)
     # http_transport = AIOHTTPTransport(url=API_URL)
 
-    async with Client(transport=realtime_transport) as session:
-        async with Client(transport=http_transport, fetch_schema_from_transport=False) as http_session:
-            print("Waiting for messages...")
+    try:
+        async with Client(transport=realtime_transport) as session:
+            async with Client(transport=http_transport, fetch_schema_from_transport=False) as http_session:
+                print("Waiting for messages...")
 
-            async for result in session.subscribe(SUBSCRIPTION):
-                print(result)
-                print(result["requestedKaraoke"])
+                async for result in session.subscribe(SUBSCRIPTION):
+                    print(result)
+                    print(result["requestedKaraoke"])
 
-                task = asyncio.create_task(add_karaoke_mutation(http_session, result["requestedKaraoke"]))
+                    task = asyncio.create_task(add_karaoke_mutation(workers, http_session, result["requestedKaraoke"]))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    task.add_done_callback(report_failure)
+    finally:
+        workers.shutdown()
 
 # def exception_handler(loop, context):
 #     print("Caught an exception:", context['message'])
 #     loop.default_exception_handler(context)
 
-loop = asyncio.get_event_loop()
-# p = ProcessPoolExecutor(4)
-loop.run_until_complete(main())
-# loop.set_exception_handler(exception_handler)
+# Worker processes are spawned and re-import this module, so only start the server when run directly
+if __name__ == "__main__":
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main())
+    # loop.set_exception_handler(exception_handler)
 
-# get_karaoke(args.song, args.artists, args.duration, args.id)
+    # asyncio.run(get_karaoke(Workers(initializer=warm_up_workers), args.song, args.artists, args.duration, args.id))
 
@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional, Tuple
+
+from artifacts import hash_file
+
+MANIFEST_NAME = "manifest.json"
+
+
+def write_json_atomic(path: str, data):
+    """
+    Write data as JSON to a temporary file next to path and rename it into place, so path is either missing
+    or complete, never half written, even if the worker is killed partway through.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def hash_output(path: str) -> Optional[str]:
+    """Checksum of a stage's output, None if it's missing."""
+    try:
+        return hash_file(path)
+    except FileNotFoundError:
+        return None
+
+
+def run_and_hash(func, *args) -> Tuple[Optional[str], Optional[str]]:
+    """Run a stage and checksum the file it returns, in the worker that ran it, so the event loop never reads it."""
+    path = func(*args)
+    return path, hash_output(path) if path is not None else None
+
+
+class JobManifest:
+    """
+    Record of the stages a job has finished, kept in manifest.json in the job's directory: the file every stage
+    produced and its checksum. A worker that restarts after a crash picks the job up from the last stage whose
+    output is still intact instead of starting over, and never trusts a file that doesn't match its checksum.
+    Only the event loop reads and writes it, so there's a single writer per job. Outputs are hashed by the
+    caller in a worker, see hash_output and run_and_hash, since a whole song takes a while to read.
+    """
+
+    def __init__(self, job_dir: str):
+        self.path = os.path.join(job_dir, MANIFEST_NAME)
+        try:
+            with open(self.path, "r") as f:
+                self.stages = json.load(f)["stages"]
+        except (OSError, ValueError, KeyError):
+            self.stages = {}
+
+    def recorded(self, stage: str) -> Optional[str]:
+        """Path to the output the stage finished with, if it did, still to be checked with completed."""
+        entry = self.stages.get(stage)
+        return entry["path"] if entry is not None else None
+
+    def completed(self, stage: str, sha256: Optional[str]) -> Optional[str]:
+        """
+        Path to the stage's output if the stage finished and the output is intact, otherwise None.
+        sha256 is the checksum of the recorded output as it is now, None if it's missing.
+        """
+        entry = self.stages.get(stage)
+        if entry is None:
+            return None
+
+        if sha256 != entry["sha256"]:
+            print("Output of stage " + stage + " is missing or corrupt, running it again")
+            Path(entry["path"]).unlink(missing_ok=True)
+            del self.stages[stage]
+            return None
+
+        print("Stage " + stage + " already finished, resuming with " + entry["path"])
+        return entry["path"]
+
+    def record(self, stage: str, path: str, sha256: str):
+        """Mark the stage finished with its output at path, whose checksum is sha256."""
+        self.stages[stage] = {"path": path, "sha256": sha256}
+        write_json_atomic(self.path, {"stages": self.stages})
@@ -1,17 +1,47 @@
+import bisect
 import json
 import re
-from syllabify.syllable3 import generate
+import numpy as np
+from functools import lru_cache
+from typing import NamedTuple
+from timeline import UNSET, WordTimeline
+from manifest import write_json_atomic
+from syllables import (
+    SYLLABLE_CACHE_SIZE,
+    count_syllables,
+    guess_syllables,
+    normalize_word,
+    save_guess_cache,
+)
 import os
 
 
-def match(word1: str, word2: str) -> bool:
+class Token(NamedTuple):
+    """
+    A word normalized once for matching.
+    text: lowercase word stripped of punctuation, key: text with gerunds folded,
+    id: interned integer for key, syllables: syllable count of text.
+    """
+
+    text: str
+    key: str
+    id: int
+    syllables: int
+
+
+# Interned ids of every token key seen by this process, so words match by integer compare.
+# Process-local and not thread-safe: alignment only runs in the CPU worker processes, one job at a time.
+# Ids are only compared within one alignment, so they're dropped between alignments once there are this many
+TOKEN_ID_LIMIT = SYLLABLE_CACHE_SIZE * 4
+token_ids = {}
+
+
+def match_key(word: str) -> str:
     """
     How to determine word equivalence. Right now they have to be the same, but later maybe consider pronunciation.
+    Returns the canonical form of the word, two words match when their keys are equal.
     """
-    temp_word1 = word1
-    temp_word2 = word2
-    temp_word1 = re.sub(r"[^\w']+", "", temp_word1).lower()
-    temp_word2 = re.sub(r"[^\w']+", "", temp_word2).lower()
+    key = normalize_word(word)
 
     # Check equality by if words have the same nucleus, similar to if they rhyme they're close enough
     # if generate(word1.rstrip()) == None or generate(word2.rstrip()) == None:
@@ -24,62 +54,59 @@ def match(word1: str, word2: str) -> bool:
     # and syllables1[0].get_nucleus() == syllables2[0].get_nucleus()
 
     # gerunds that end in " ing " versus " in' " are the same word
-    if temp_word1.endswith("ing") and temp_word2.endswith("in'"):
-        temp_word1 = temp_word1[:-1] + "'"
-    if temp_word1.endswith("in'") and temp_word2.endswith("ing"):
-        temp_word2 = temp_word2[:-1] + "'"
+    if key.endswith("ing"):
+        key = key[:-1] + "'"
+
+    return key
 
-    return temp_word1 == temp_word2
 
+@lru_cache(maxsize=SYLLABLE_CACHE_SIZE)
+def tokenize(word: str) -> Token:
+    """Normalize a raw musixmatch or whisper word into a Token, once per distinct word."""
+    text = normalize_word(word)
+    key = match_key(text)
+    return Token(text, key, token_ids.setdefault(key, len(token_ids)), count_syllables(text))
 
-def guess_syllables(word):
+
+def trim_token_ids():
     """
-    Fall back function for estimating number of syllables in case word is not found in CMU dictionary.
+    Forget every interned token id if there are more than TOKEN_ID_LIMIT, so a long running worker doesn't keep
+    every word it has ever seen. Only call between alignments, ids handed out before are reused afterwards.
     """
-    # referred from stackoverflow.com/questions/14541303/count-the-number-of-syllables-in-a-word
-    count = 0
-    vowels = "aeiouy"
-    word = word.lower()
-    if word[0] in vowels:
-        count += 1
-    for index in range(1, len(word)):
-        if word[index] in vowels and word[index - 1] not in vowels:
-            count += 1
-    if word.endswith("e"):
-        count -= 1
-    if word.endswith("le"):
-        count += 1
-    if count == 0:
-        count += 1
-    return count
-
-
-def count_syllables(word: str) -> int:
+    if len(token_ids) > TOKEN_ID_LIMIT:
+        token_ids.clear()
+        # Cached tokens carry the old ids
+        tokenize.cache_clear()
+
+
+def match(word1: str, word2: str) -> bool:
     """
-    Returns number of syllables in the word, referencing the CMU dictionary, otherwise estimates.
+    Whether two raw words are the same word. Kept for backwards compatibility, compare Token ids in new code.
     """
-    word = re.sub(r"[^\w']+", "", word).lower().rstrip()
-    if len(word) == 0:
-        return 0
-    try:
-        syl = generate(word)
-        return len(list(syl)[0])
-    except TypeError:
-        return guess_syllables(word)
+    return tokenize(word1).id == tokenize(word2).id
+
+
+def make_timeline(words, start, end, line_indices=None) -> WordTimeline:
+    """Build a WordTimeline, tokenizing every word once."""
+    tokens = [tokenize(word) for word in words]
+    return WordTimeline(
+        words,
+        [token.id for token in tokens],
+        [token.syllables for token in tokens],
+        start,
+        end,
+        line_indices,
+    )
 
 
-def get_musixmatch_data(musixmatch_json) -> (list[list[dict]], list[dict], list[int]):
+def get_musixmatch_timeline(musixmatch_json) -> WordTimeline:
     """
-    Return a list of lines for the musixmatch lyric data, where each line is a list of words.
-    A word is a dict: {"word": str, "startTime": int, "endTime": int}
-    Also returns a list of all the musixmatch words not separated into lines.
-    Finally, returns the indices of those words that correspond with the start of the lines.
+    Return the musixmatch lyric data as a WordTimeline split into lines.
+    Only the first word of every line has a start time, the rest are UNSET.
     """
-    m_lyrics = []
-    m_words = []
-    m_line_indices = []
-
-    m_word_index = 0
+    words = []
+    start_times = []
+    line_indices = []
 
     for line in musixmatch_json["lines"]:
         # Incinerate everything in paretheses, these are typically polyphonic vocal lines
@@ -92,61 +119,65 @@ def get_musixmatch_data(musixmatch_json) -> (list[list[dict]], list[dict], list[
         # Turns out that does't work, you need to decode it first. We'll just replace it manually, since it's likely the only symbol to occur in lyrics.
         line["words"] = re.sub(r"♪", "", line["words"])
 
-        words = re.split(r"[\s-]+", line["words"])
-        line_lyrics = []
+        line_words = re.split(r"[\s-]+", line["words"])
 
         # Filter out empty words and words with no syllables, e.g. "..."
-        words = [w for w in words if (w != "") and (count_syllables(w) != 0)]
+        line_words = [w for w in line_words if (w != "") and (tokenize(w).syllables != 0)]
 
-        for i in range(len(words)):
-            start_time = int(line["startTimeMs"]) if i == 0 else None
-            end_time = None
-            word_data = {"word": words[i], "startTime": start_time, "endTime": end_time}
+        # Lines with nothing left to sing would have no start word to align
+        if len(line_words) == 0:
+            continue
 
-            line_lyrics.append(word_data)
+        line_indices.append(len(words))
 
-            if i == 0:
-                m_line_indices.append(m_word_index)
-
-            m_word_index += 1
-
-        if len(line["words"]) != 0:
-            m_lyrics.append(line_lyrics)
-            m_words.extend(line_lyrics)
+        for i in range(len(line_words)):
+            words.append(line_words[i])
+            start_times.append(int(line["startTimeMs"]) if i == 0 else UNSET)
 
     # Append one more for easy slicing
-    m_line_indices.append(len(m_words))
+    line_indices.append(len(words))
 
-    return m_lyrics, m_words, m_line_indices
+    return make_timeline(words, start_times, [UNSET] * len(words), line_indices)
 
 
-def get_whisper_words(whisper_json) -> list[dict]:
+def get_musixmatch_data(musixmatch_json) -> (list[list[dict]], list[dict], list[int]):
     """
-    Return a list of all the words taken from the whisper transcription.
+    Return a list of lines for the musixmatch lyric data, where each line is a list of words.
     A word is a dict: {"word": str, "startTime": int, "endTime": int}
+    Also returns a list of all the musixmatch words not separated into lines.
+    Finally, returns the indices of those words that correspond with the start of the lines.
     """
+    timeline = get_musixmatch_timeline(musixmatch_json)
+
+    m_words = timeline.to_dicts()
+    m_lyrics = get_lines(m_words, timeline.line_indices)
+
+    return m_lyrics, m_words, timeline.line_indices
 
+
+def get_whisper_timeline(whisper_json) -> WordTimeline:
+    """Return all the words taken from the whisper transcription as a WordTimeline."""
     words = []
+    start_times = []
+    end_times = []
 
-    # First get all the words from whisper
     for line in whisper_json:
-        line_words = [
-            {
-                "word": word["word"],
-                "startTime": int(word["start"] * 1000),
-                "endTime": int(word["end"] * 1000),
-            }
-            for word in line["words"]
-            if "start" in word
-        ]
+        for word in line["words"]:
+            # Words whisper couldn't align have no timestamps
+            if "start" in word:
+                words.append(word["word"])
+                start_times.append(int(word["start"] * 1000))
+                end_times.append(int(word["end"] * 1000))
 
-        print_line = ""
-        for word in line_words:
-            print_line += word["word"] + " "
-            words.append(word)
-        # print(l)
+    return make_timeline(words, start_times, end_times)
 
-    return words
+
+def get_whisper_words(whisper_json) -> list[dict]:
+    """
+    Return a list of all the words taken from the whisper transcription.
+    A word is a dict: {"word": str, "startTime": int, "endTime": int}
+    """
+    return get_whisper_timeline(whisper_json).to_dicts()
 
 
 def get_whisper_line_breaks(w_words, m_lines, MAX_TIME_GAP_MS: int = 500):
@@ -154,23 +185,56 @@ def get_whisper_line_breaks(w_words, m_lines, MAX_TIME_GAP_MS: int = 500):
     Get indices of all whisper words that correspond to the start of a musixmatch line.
     Plus an index at the end of the song marking where the whisper words terminate.
     """
+    return find_line_breaks(
+        [w_word["startTime"] for w_word in w_words],
+        [tokenize(w_word["word"]).id for w_word in w_words],
+        [m_line[0]["startTime"] for m_line in m_lines],
+        [tokenize(m_line[0]["word"]).id for m_line in m_lines],
+        MAX_TIME_GAP_MS,
+    )
+
+
+def find_line_breaks(w_times, w_ids, m_starts, m_ids, MAX_TIME_GAP_MS: int = 500) -> list[int]:
+    """
+    get_whisper_line_breaks on plain lists: whisper word start times and token ids,
+    and the start time and first word token id of every musixmatch line.
+    """
     line_word_breaks = []
 
-    for m_line in m_lines:
+    # Timestamps are sorted in practice, which lets every line only look at the whisper words around its start time
+    is_sorted = all(w_times[i] <= w_times[i + 1] for i in range(len(w_times) - 1))
+
+    for m_start, m_id in zip(m_starts, m_ids):
+
         # Time difference between whisper word timestamp and musixmatch line timestamp
-        min_time_dif = abs(w_words[0]["startTime"] - m_line[0]["startTime"])
-        prev_time_dif = abs(w_words[0]["startTime"] - m_line[0]["startTime"])
+        min_time_dif = abs(w_times[0] - m_start)
+        prev_time_dif = abs(w_times[0] - m_start)
 
         # booleans representing if the lyrics match
-        prev_match = match(w_words[0]["word"], m_line[0]["word"])
-        curr_match = match(w_words[0]["word"], m_line[0]["word"])
+        prev_match = w_ids[0] == m_id
 
         word_index = 0
+        first_index = 0
+
+        if is_sorted:
+            # Words more than MAX_TIME_GAP_MS before the line only ever move closer to it, so each one is the new
+            # minimum until the last of them. Jump straight to that state.
+            first_index = bisect.bisect_right(w_times, m_start - MAX_TIME_GAP_MS)
+            if first_index > 0:
+                min_time_dif = m_start - w_times[first_index - 1]
+                prev_time_dif = min_time_dif
+                prev_match = w_ids[first_index - 1] == m_id
+                # The first word to reach that minimum is the one that was kept
+                word_index = bisect.bisect_left(w_times, w_times[first_index - 1])
+
+        for w_index in range(first_index, len(w_times)):
+            time_dif = abs(w_times[w_index] - m_start)
 
-        for w_index, w_word in enumerate(w_words):
-            time_dif = abs(w_word["startTime"] - m_line[0]["startTime"])
+            # Past the line start, differences only grow, so nothing after can be closer or within the gap
+            if is_sorted and w_times[w_index] >= m_start and time_dif >= max(min_time_dif, MAX_TIME_GAP_MS):
+                break
 
-            curr_match = match(w_word["word"], m_line[0]["word"])
+            curr_match = w_ids[w_index] == m_id
 
             # Match w word to start of m line if its the minimum time,
             # - OR its a perfect word match even if its not the minimum, but only if previous is not also perfect
@@ -190,7 +254,7 @@ def get_whisper_line_breaks(w_words, m_lines, MAX_TIME_GAP_MS: int = 500):
         line_word_breaks.append(word_index)
 
     # Append one more index so we can slice easily
-    line_word_breaks.append(len(w_words))
+    line_word_breaks.append(len(w_times))
 
     return line_word_breaks
 
@@ -213,15 +277,426 @@ def get_lines(word_list, index_list):
     return lines
 
 
+def fill_match_table(m_ids, m_syls, w_ids, w_syls, m_word_i, w_word_i) -> list[list[dict]]:
+    """
+    Fill the matches table for one line, similar to greatest common subsequence.
+    The line's words are given as token ids and syllable counts, see WordTimeline.
+    Cell [m_i][w_i] holds the best alignment of the first m_i musixmatch words with the first w_i whisper words:
+    {"matches": <number of matched words>, "m_i": <index of last matched musixmatch word>,
+     "w_i": <index of last matched whisper word>, "syl_dif": <syllable offset between the last matched words>}
+    m_word_i and w_word_i are the indices of the first words of the line in the whole song.
+    """
+    m_line_len = len(m_ids)
+    w_line_len = len(w_ids)
+
+    # Initialize the array with leading row and column of zeroes
+    default_match = {"matches": 0, "m_i": None, "w_i": None, "syl_dif": 999}
+    match_arr = [[default_match] * (w_line_len + 1)] + [
+        [default_match] + [None] * w_line_len for _ in range(m_line_len)
+    ]
+
+    m_syl_i = 0
+
+    for m_i, (m_id, m_syl) in enumerate(zip(m_ids, m_syls), 1):
+        w_syl_i = 0
+
+        for w_i, (w_id, w_syl) in enumerate(zip(w_ids, w_syls), 1):
+            prev_m = match_arr[m_i - 1][w_i]
+            prev_w = match_arr[m_i][w_i - 1]
+
+            if m_id != w_id:
+                if prev_m["matches"] > prev_w["matches"]:
+                    match_arr[m_i][w_i] = prev_m
+                elif prev_m["matches"] < prev_w["matches"]:
+                    match_arr[m_i][w_i] = prev_w
+                else:
+                    match_arr[m_i][w_i] = (
+                        prev_m
+                        if prev_m["syl_dif"] < prev_w["syl_dif"]
+                        else prev_w
+                    )
+            else:
+                matches = match_arr[m_i - 1][w_i - 1]["matches"] + 1
+                syl_dif = abs(m_syl_i - w_syl_i)
+
+                if (
+                    matches == prev_m["matches"]
+                    and syl_dif >= prev_m["syl_dif"]
+                ):
+                    match_arr[m_i][w_i] = prev_m
+                elif (
+                    matches == prev_w["matches"]
+                    and syl_dif >= prev_w["syl_dif"]
+                ):
+                    match_arr[m_i][w_i] = prev_w
+                else:
+                    # set to m_i - 1 and w_i - 1 to account for the row/column indices starting at 1
+                    total_m_i = m_word_i
+                    total_w_i = w_i - 1 + w_word_i
+                    match_arr[m_i][w_i] = {
+                        "matches": matches,
+                        "m_i": total_m_i,
+                        "w_i": total_w_i,
+                        "syl_dif": syl_dif,
+                    }
+
+            w_syl_i += w_syl
+
+        m_syl_i += m_syl
+        m_word_i += 1
+
+    return match_arr
+
+
+class MatchTableRow:
+    def __init__(self, table, m_i):
+        self.table = table
+        self.m_i = m_i
+
+    def __getitem__(self, w_i) -> dict:
+        return self.table.cell(self.m_i, w_i)
+
+
+class MatchTable:
+    """
+    NumPy backed matches table, indexed like the list of lists from fill_match_table: table[m_i][w_i]["matches"].
+    Cells are only turned into dicts when read, so the backtrace only pays for the cells it visits.
+    """
+
+    def __init__(self, matches, m_indices, w_indices, syl_difs):
+        self.matches = matches
+        self.m_indices = m_indices
+        self.w_indices = w_indices
+        self.syl_difs = syl_difs
+
+    def __getitem__(self, m_i) -> MatchTableRow:
+        return MatchTableRow(self, m_i)
+
+    def cell(self, m_i, w_i) -> dict:
+        m_index = int(self.m_indices[m_i, w_i])
+        w_index = int(self.w_indices[m_i, w_i])
+        return {
+            "matches": int(self.matches[m_i, w_i]),
+            "m_i": m_index if m_index >= 0 else None,
+            "w_i": w_index if w_index >= 0 else None,
+            "syl_dif": int(self.syl_difs[m_i, w_i]),
+        }
+
+
+def fill_match_table_numpy(m_ids, m_syls, w_ids, w_syls, m_word_i, w_word_i) -> MatchTable:
+    """
+    Same table as fill_match_table, computed with NumPy one anti-diagonal at a time.
+    Every cell only depends on the cells above, to the left and diagonally above-left, which all lie on
+    earlier anti-diagonals, so each anti-diagonal can be filled in a single vectorized step.
+    The table is stored skewed, one anti-diagonal per row, so every step reads and writes plain slices.
+    """
+    m_line_len = len(m_ids)
+    w_line_len = len(w_ids)
+    diagonals = m_line_len + w_line_len + 1
+
+    # Syllables before each word in the line
+    m_syl_counts = np.asarray(m_syls, dtype=np.int64)
+    w_syl_counts = np.asarray(w_syls, dtype=np.int64)
+    m_syl_starts = np.cumsum(m_syl_counts) - m_syl_counts
+    w_syl_starts = np.cumsum(w_syl_counts) - w_syl_counts
+
+    # Cell [m_i][w_i] is column m_i of row m_i + w_i. Cells outside the table are clamped, they're never read
+    m_i = np.arange(m_line_len + 1)[None, :]
+    w_i = np.arange(diagonals)[:, None] - m_i
+    m_word = np.clip(m_i - 1, 0, max(m_line_len - 1, 0))
+    w_word = np.clip(w_i - 1, 0, max(w_line_len - 1, 0))
+
+    if m_line_len != 0 and w_line_len != 0:
+        is_match = np.asarray(m_ids)[m_word] == np.asarray(w_ids)[w_word]
+        syl_dif = np.abs(m_syl_starts[m_word] - w_syl_starts[w_word])
+    else:
+        is_match = np.zeros((diagonals, m_line_len + 1), dtype=bool)
+        syl_dif = np.zeros((diagonals, m_line_len + 1), dtype=np.int64)
+
+    # Fields of a new match at every cell, the number of matches is filled in as each diagonal is reached
+    new_cells = np.stack(
+        np.broadcast_arrays(np.zeros_like(syl_dif), m_word_i + m_i - 1, w_word_i + w_i - 1, syl_dif)
+    )
+
+    # Matches, m_i, w_i and syl_dif of every cell, starting as the default match everywhere. -1 stands in for None
+    table = np.empty((4, diagonals, m_line_len + 1), dtype=np.int64)
+    table[:] = np.array([0, -1, -1, 999])[:, None, None]
+
+    for diagonal in range(2, diagonals):
+        first = max(1, diagonal - w_line_len)
+        stop = min(m_line_len, diagonal - 1) + 1
+
+        prev_m = table[:, diagonal - 1, first - 1:stop - 1]
+        prev_w = table[:, diagonal - 1, first:stop]
+        new = new_cells[:, diagonal, first:stop]
+        new[0] = table[0, diagonal - 2, first - 1:stop - 1] + 1
+
+        # Words don't match: carry over the neighbour with more matches, or the smaller syllable offset
+        no_match_take_m = (prev_m[0] > prev_w[0]) | ((prev_m[0] == prev_w[0]) & (prev_m[3] < prev_w[3]))
+        # Words match: only record a new match if it beats both neighbours
+        match_take_m = (new[0] == prev_m[0]) & (new[3] >= prev_m[3])
+        match_take_w = ~match_take_m & (new[0] == prev_w[0]) & (new[3] >= prev_w[3])
+
+        cell_match = is_match[diagonal, first:stop]
+        take_m = np.where(cell_match, match_take_m, no_match_take_m)
+        take_w = np.where(cell_match, match_take_w, ~no_match_take_m)
+
+        table[:, diagonal, first:stop] = np.where(take_m, prev_m, np.where(take_w, prev_w, new))
+
+    # Unskew into [m_i][w_i] order once, for the backtrace
+    rows = np.arange(m_line_len + 1)[:, None]
+    columns = np.arange(w_line_len + 1)[None, :]
+    return MatchTable(*table[:, rows + columns, rows])
+
+
+def estimate_word_times(musixmatch: WordTimeline, whisper: WordTimeline) -> list[int]:
+    """
+    Estimate a start time for every musixmatch word, which only has timestamps at the start of each line.
+    Words are spread across the time until the next line starts, in proportion to their syllables.
+    """
+    times = []
+    song_end = int(whisper.end[-1]) if len(whisper) != 0 else 0
+    line_starts = musixmatch.start[musixmatch.line_indices[:-1]].tolist()
+
+    for line_i, line_start in enumerate(line_starts):
+        if line_i + 1 < len(line_starts):
+            line_end = line_starts[line_i + 1]
+        else:
+            line_end = max(song_end, line_start)
+
+        syl_counts = musixmatch.syllables[musixmatch.line(line_i)].tolist()
+        syl_total = sum(syl_counts)
+
+        syl_i = 0
+        for syl_count in syl_counts:
+            times.append(line_start + ((line_end - line_start) * syl_i) // syl_total)
+            syl_i += syl_count
+
+    return times
+
+
+def get_banded_word_matches(
+    musixmatch: WordTimeline, whisper: WordTimeline, BAND_MS: int = 5000
+) -> (list[int], list[int]):
+    """
+    Match whisper words to musixmatch words over the whole song at once, similar to greatest common subsequence.
+    A musixmatch word may only match a whisper word starting within BAND_MS of its estimated start time,
+    so only a band of the table is computed, O(words * band) in time and memory.
+    Ties in the number of matches are broken by the smallest total time difference between matched words.
+    Returns the indices of the matched musixmatch words and of the whisper words they matched.
+    """
+    m_len = len(musixmatch)
+    w_len = len(whisper)
+
+    m_times = np.array(estimate_word_times(musixmatch, whisper), dtype=np.int64)
+    w_times = whisper.start.astype(np.int64)
+    # Whisper timestamps should already be sorted, but the band must be monotonic for the recurrence below
+    w_times = np.maximum.accumulate(w_times) if w_len != 0 else w_times
+
+    m_tokens = musixmatch.ids
+    w_tokens = whisper.ids
+
+    # Row i of the table is the first i musixmatch words, column j the first j whisper words.
+    # Musixmatch word i - 1 can match whisper words [band_start[i], band_end[i]), so row i is only computed for
+    # columns band_start[i] to band_end[i]: left of that the value is the row above, right of that it's constant.
+    band_start = np.maximum.accumulate(np.searchsorted(w_times, m_times - BAND_MS, side="left"))
+    band_end = np.maximum.accumulate(np.searchsorted(w_times, m_times + BAND_MS, side="right"))
+    band_start = np.concatenate(([0], band_start))
+    band_end = np.concatenate(([0], band_end))
+
+    # Score every match so more matches always wins, then smaller time difference
+    match_score = 1 << 32
+
+    rows = [np.zeros(1, dtype=np.int64)]
+
+    for i in range(1, m_len + 1):
+        start = band_start[i]
+        end = band_end[i]
+        prev_start = band_start[i - 1]
+        prev_end = band_end[i - 1]
+        prev_row = rows[i - 1]
+
+        # Previous row's value at columns start - 1 to end, clamped to its last computed column
+        columns = np.arange(start - 1, end + 1)
+        prev = prev_row[np.clip(columns, prev_start, prev_end) - prev_start]
+        up = prev[1:]
+        diag = prev[:-1]
+
+        w_j = np.arange(start, end)
+        is_match = w_tokens[w_j] == m_tokens[i - 1]
+        gain = match_score - np.abs(w_times[w_j] - m_times[i - 1])
+
+        candidates = up.copy()
+        candidates[1:] = np.maximum(up[1:], np.where(is_match, diag[1:] + gain, up[1:]))
+        rows.append(np.maximum.accumulate(candidates))
+
+    # Trace backwards to get the optimal matches
+    m_matches = []
+    w_matches = []
+
+    i = m_len
+    j = w_len
+
+    while i > 0 and j > 0:
+        start = band_start[i]
+        end = band_end[i]
+
+        if j > end:
+            j = end
+            continue
+        if j < start:
+            i -= 1
+            continue
+
+        row = rows[i]
+        value = row[j - start]
+
+        if j > start and value == row[j - start - 1]:
+            j -= 1
+            continue
+
+        prev_start = band_start[i - 1]
+        prev_end = band_end[i - 1]
+        prev_row = rows[i - 1]
+        up = prev_row[min(max(j, prev_start), prev_end) - prev_start]
+
+        if value == up:
+            i -= 1
+        else:
+            m_matches.insert(0, i - 1)
+            w_matches.insert(0, j - 1)
+            i -= 1
+            j -= 1
+
+    return m_matches, w_matches
+
+
+def interpolate_gap_times(
+    musixmatch: WordTimeline, whisper: WordTimeline, m_matches, w_matches, last_line_start: int
+):
+    """
+    Time stamp every musixmatch word in place. Matched words take the times of their whisper word.
+    Unmatched musixmatch words in the gap between two matches are timed by the syllables of the whisper words in
+    the same gap, splitting each whisper word evenly into its syllables. If musixmatch has more syllables than whisper
+    in a gap, extra syllables are spread evenly up to the next whisper word (or a guess at the start / end of the song).
+    All gaps are computed in one batch of array operations.
+    """
+    m_matches = np.asarray(m_matches, dtype=np.int64)
+    w_matches = np.asarray(w_matches, dtype=np.int64)
+    m_len = len(musixmatch)
+    w_len = len(whisper)
+
+    w_start = whisper.start.astype(np.float64)
+    w_end = whisper.end.astype(np.float64)
+    w_syls = whisper.syllables.astype(np.int64)
+
+    # Assign time stamps for the perfectly matched words
+    musixmatch.start[m_matches] = whisper.start[w_matches]
+    musixmatch.end[m_matches] = whisper.end[w_matches]
+
+    # Read after the matches are timed, like the gap loop this replaced: if the first word is matched,
+    # it's whisper's time for it, otherwise still the time musixmatch gives its line
+    m_first_start = float(musixmatch.start[0])
+
+    # Gap k lies between match k - 1 and match k, plus one more gap after the last match
+    m_gap_starts = np.concatenate(([0], m_matches + 1))
+    m_gap_ends = np.concatenate((m_matches, [m_len]))
+    w_gap_starts = np.concatenate(([0], w_matches + 1))
+    w_gap_ends = np.concatenate((w_matches, [w_len]))
+
+    gaps = np.flatnonzero(m_gap_ends > m_gap_starts)
+    if len(gaps) == 0:
+        return
+
+    # Syllable offsets of every word, so the syllables of a gap are a contiguous range
+    m_syl_offsets = np.concatenate(([0], np.cumsum(musixmatch.syllables, dtype=np.int64)))
+    w_syl_offsets = np.concatenate(([0], np.cumsum(w_syls)))
+
+    # Padding at line starts can leave whisper matches out of order, those gaps are empty
+    w_gap_lengths = np.maximum(w_gap_ends[gaps] - w_gap_starts[gaps], 0)
+
+    m_syl_total = m_syl_offsets[m_gap_ends[gaps]] - m_syl_offsets[m_gap_starts[gaps]]
+    w_syl_total = np.where(
+        w_gap_lengths != 0, w_syl_offsets[w_gap_ends[gaps]] - w_syl_offsets[w_gap_starts[gaps]], 0
+    )
+    extra_syl = m_syl_total - w_syl_total
+
+    # Generate timestamps for whisper by breaking words into syllables, interpolating between words by syllables
+    syl_word = np.repeat(np.arange(w_len), w_syls)
+    syl_in_word = np.arange(len(syl_word)) - w_syl_offsets[syl_word]
+    syl_length = (w_end - w_start)[syl_word] / w_syls[syl_word]
+    w_syl_starts = w_start[syl_word] + syl_length * syl_in_word
+    w_syl_ends = w_start[syl_word] + syl_length * (syl_in_word + 1)
+
+    # Some of the musixmatch syllables don't have a corresponding syllable in whisper, so generate extra
+    # timestamps between the borders of the gap
+    # The extra syllables start after the last whisper word of the gap, or the match before it if it has none.
+    # The leading gap has no match before it, its whisper words are the ones before the first match.
+    prev_matches = w_matches[np.maximum(gaps - 1, 0)] if len(w_matches) != 0 else np.zeros(len(gaps), dtype=np.int64)
+    prev_border_i = np.where((gaps == 0) & (w_gap_lengths != 0), w_gap_lengths - 1, prev_matches + w_gap_lengths)
+    next_border_i = w_gap_ends[gaps]
+
+    # If the first musixmatch words are unmatched and the first whisper word is the first match, we guess where the start
+    # of the line is by taking the first detected whisper word - (the length of the first word * number of missing words)
+    # This cannot be earlier that 0, the start of the song
+    w_first_syl_length = (w_end[0] - w_start[0]) / w_syls[0]
+    w_last_syl_length = (w_end[-1] - w_start[-1]) / w_syls[-1]
+
+    prev_border = np.where(
+        (prev_border_i == 0) & (next_border_i == 0),
+        np.maximum(np.minimum(m_first_start, w_start[0] - extra_syl * w_first_syl_length), 0),
+        w_end[np.minimum(prev_border_i, w_len - 1)],
+    )
+
+    # If the last musixmatch words are unmatched, we calculate the end border in a similar way
+    # Should also make it not go past the end of the song
+    next_border = np.where(
+        next_border_i < w_len,
+        w_start[np.minimum(next_border_i, w_len - 1)],
+        np.maximum(w_end[-1] + w_last_syl_length * extra_syl, last_line_start),
+    )
+    extra_length = (next_border - prev_border) / np.maximum(extra_syl, 1)
+
+    # Assign timestamps to the unmatched musixmatch words from whisperwords by syllable count:
+    # the n-th word of a gap takes the n-th syllable timestamp of the gap
+    gap_word_counts = m_gap_ends[gaps] - m_gap_starts[gaps]
+    word_gap = np.repeat(np.arange(len(gaps)), gap_word_counts)
+    word_in_gap = np.arange(len(word_gap)) - np.repeat(np.cumsum(gap_word_counts) - gap_word_counts, gap_word_counts)
+    m_gap_words = m_gap_starts[gaps][word_gap] + word_in_gap
+
+    from_whisper = word_in_gap < w_syl_total[word_gap]
+    w_syl_i = np.minimum(w_syl_offsets[w_gap_starts[gaps]][word_gap] + word_in_gap, max(len(syl_word) - 1, 0))
+    extra_i = word_in_gap - w_syl_total[word_gap]
+
+    if len(syl_word) != 0:
+        whisper_starts = w_syl_starts[w_syl_i]
+        whisper_ends = w_syl_ends[w_syl_i]
+    else:
+        whisper_starts = whisper_ends = np.zeros(len(word_gap))
+
+    extra_starts = prev_border[word_gap] + extra_length[word_gap] * extra_i
+    extra_ends = prev_border[word_gap] + extra_length[word_gap] * (extra_i + 1)
+
+    musixmatch.start[m_gap_words] = np.round(np.where(from_whisper, whisper_starts, extra_starts))
+    musixmatch.end[m_gap_words] = np.round(np.where(from_whisper, whisper_ends, extra_ends))
+
+
 """Public Method"""
 
 
-def get_karaoke_lines(m_path: str, w_path: str, lyrics_dir: str) -> str:
+def get_karaoke_lines(
+    m_path: str, w_path: str, lyrics_dir: str, engine: str = "python", mode: str = "lines"
+) -> str:
     """Time stamp the start and end of every word in a song, grouped by lines, for karaoke playback.
 
     Args:
         m_path: file path of the Musixmatch json data file of the lyrics, such as that generated by syrics.
         w_path: file path of the Whisper json data file of the audio transcription.
+        engine: "python" to fill the word alignment tables cell by cell, or "numpy" to fill them with vectorized
+            NumPy operations. Both produce identical alignments. NumPy only pays off for lines of a few hundred
+            words, on typical lines its per-call overhead makes it several times slower.
+        mode: "lines" to assign whisper words to musixmatch lines first and align each line separately,
+            or "song" to align the whole song at once within a time band, see get_banded_word_matches.
 
     Returns:
         Path to json file containin lyrics, which are a list of lines.
@@ -234,82 +709,48 @@ def get_karaoke_lines(m_path: str, w_path: str, lyrics_dir: str) -> str:
         print("Word-level timestamped lyrics json already exists. Returning path.")
         return karaoke_path
 
-    def get_word_match_indices(
-        m_lines, w_lines, m_words, w_words
-    ) -> (list[int], list[int]):
-        # m_words = m_words[:]
-        # w_words = w_words[:]
-
-        line_count = len(m_lines)
+    def get_word_match_indices(w_line_indices) -> (list[int], list[int]):
+        line_count = musixmatch.line_count()
         m_word_i = 0
         w_word_i = 0
 
         m_words_matches = []
         w_words_matches = []
 
-        for line_i in range(line_count):
-            m_line_len = len(m_lines[line_i])
-            w_line_len = len(w_lines[line_i])
-
-            # Initialize the array with leading row and column of zeroes
-            default_match = {"matches": 0, "m_i": None, "w_i": None, "syl_dif": 999}
-            match_arr = [[default_match] * (w_line_len + 1)] + [
-                [default_match] + [None] * w_line_len for _ in range(m_line_len)
-            ]
-
-            m_syl_i = 0
-
-            for m_i, m_word in enumerate(m_lines[line_i], 1):
-                m_syl = count_syllables(m_word["word"])
-                w_syl_i = 0
-
-                for w_i, w_word in enumerate(w_lines[line_i], 1):
-                    w_syl = count_syllables(w_word["word"])
-
-                    prev_m = match_arr[m_i - 1][w_i]
-                    prev_w = match_arr[m_i][w_i - 1]
-
-                    if not match(m_word["word"], w_word["word"]):
-                        if prev_m["matches"] > prev_w["matches"]:
-                            match_arr[m_i][w_i] = prev_m
-                        elif prev_m["matches"] < prev_w["matches"]:
-                            match_arr[m_i][w_i] = prev_w
-                        else:
-                            match_arr[m_i][w_i] = (
-                                prev_m
-                                if prev_m["syl_dif"] < prev_w["syl_dif"]
-                                else prev_w
-                            )
-                    else:
-                        matches = match_arr[m_i - 1][w_i - 1]["matches"] + 1
-                        syl_dif = abs(m_syl_i - w_syl_i)
+        # Whisper words get padded and deleted below, but lines are matched as whisper originally transcribed them.
+        # Inserting and deleting allocates new arrays, so views taken up front still see the original words.
+        w_lines = [
+            (whisper.ids[start:end], whisper.syllables[start:end])
+            for start, end in zip(w_line_indices[:-1], w_line_indices[1:])
+        ]
 
-                        if (
-                            matches == prev_m["matches"]
-                            and syl_dif >= prev_m["syl_dif"]
-                        ):
-                            match_arr[m_i][w_i] = prev_m
-                        elif (
-                            matches == prev_w["matches"]
-                            and syl_dif >= prev_w["syl_dif"]
-                        ):
-                            match_arr[m_i][w_i] = prev_w
-                        else:
-                            # set to m_i - 1 and w_i - 1 to account for the row/column indices starting at 1
-                            total_m_i = m_word_i
-                            total_w_i = w_i - 1 + w_word_i
-                            match_arr[m_i][w_i] = {
-                                "matches": matches,
-                                "m_i": total_m_i,
-                                "w_i": total_w_i,
-                                "syl_dif": syl_dif,
-                            }
-
-                    w_syl_i += w_syl
-
-                m_syl_i += m_syl
-                m_word_i += 1
+        for line_i in range(line_count):
+            m_line = musixmatch.line(line_i)
+            w_line_ids, w_line_syls = w_lines[line_i]
+
+            m_line_len = m_line.stop - m_line.start
+            w_line_len = len(w_line_ids)
+
+            if engine == "numpy":
+                match_arr = fill_match_table_numpy(
+                    musixmatch.ids[m_line],
+                    musixmatch.syllables[m_line],
+                    w_line_ids,
+                    w_line_syls,
+                    m_word_i,
+                    w_word_i,
+                )
+            else:
+                match_arr = fill_match_table(
+                    musixmatch.ids[m_line].tolist(),
+                    musixmatch.syllables[m_line].tolist(),
+                    w_line_ids.tolist(),
+                    w_line_syls.tolist(),
+                    m_word_i,
+                    w_word_i,
+                )
 
+            m_word_i += m_line_len
             w_word_i += w_line_len
 
             # Debug the matches array
@@ -326,8 +767,8 @@ def get_karaoke_lines(m_path: str, w_path: str, lyrics_dir: str) -> str:
             matches_m = []
             matches_w = []
 
-            trace_m_i = len(m_lines[line_i])
-            trace_w_i = len(w_lines[line_i])
+            trace_m_i = m_line_len
+            trace_w_i = w_line_len
             trace_curr = match_arr[trace_m_i][trace_w_i]
 
             while (
@@ -341,9 +782,9 @@ def get_karaoke_lines(m_path: str, w_path: str, lyrics_dir: str) -> str:
                 # print(str(w_word_i) + " " + str(len(w_words_copy)))
                 # print(str(trace_w_i + w_word_i - w_line_len - 1))
                 
-                if match(
-                    m_words[trace_m_i + m_word_i - m_line_len - 1]["word"],
-                    w_words[trace_w_i + w_word_i - w_line_len - 1]["word"],
+                if (
+                    musixmatch.ids[trace_m_i + m_word_i - m_line_len - 1]
+                    == whisper.ids[trace_w_i + w_word_i - w_line_len - 1]
                 ):
                     matches = match_arr[trace_m_i][trace_w_i]["matches"]
                     syl_dif = match_arr[trace_m_i][trace_w_i]["syl_dif"]
@@ -387,14 +828,14 @@ def get_karaoke_lines(m_path: str, w_path: str, lyrics_dir: str) -> str:
                 m_word_i - m_line_len not in matches_m
                 and w_word_i - w_line_len not in matches_w
             ):
-                # print(len(whisper_words))
+                # print(len(whisper))
                 # print(str(w_word_i) + " " + str(w_line_len) + " " + str(w_word_i - w_line_len))
                 # Alter whisper words to break apart first word of the line so remaining syllables can still be matched
-                m_fir = musixmatch_words[m_word_i - m_line_len]
-                w_fir = whisper_words[w_word_i - w_line_len]
+                m_fir_i = m_word_i - m_line_len
+                w_fir_i = w_word_i - w_line_len
 
-                m_fir_syl = count_syllables(m_fir["word"])
-                w_fir_syl = count_syllables(w_fir["word"])
+                m_fir_syl = int(musixmatch.syllables[m_fir_i])
+                w_fir_syl = int(whisper.syllables[w_fir_i])
 
                 fir_syl_dif = m_fir_syl - w_fir_syl
 
@@ -402,20 +843,18 @@ def get_karaoke_lines(m_path: str, w_path: str, lyrics_dir: str) -> str:
                 if fir_syl_dif < 0:
                     extra_syl = abs(fir_syl_dif)
 
+                    w_fir_start = int(whisper.start[w_fir_i])
+                    w_fir_end = int(whisper.end[w_fir_i])
+
                     # Add a new padword from the remains of the first whisper word
-                    pad_start = (
-                        ((w_fir["endTime"] - w_fir["startTime"]) / w_fir_syl)
-                        * (w_fir_syl - extra_syl)
-                    ) + w_fir["startTime"]
-                    pad_word = {
-                        "word": "pad" * extra_syl,
-                        "startTime": pad_start,
-                        "endTime": w_fir["endTime"],
-                    }
-                    whisper_words.insert(w_word_i - w_line_len + 1, pad_word)
+                    pad_start = round(
+                        (((w_fir_end - w_fir_start) / w_fir_syl) * (w_fir_syl - extra_syl))
+                        + w_fir_start
+                    )
+                    insert_pad(w_fir_i + 1, extra_syl, pad_start, w_fir_end)
 
                     # Change end time of first word since we cut it
-                    whisper_words[w_word_i - w_line_len]["endTime"] = pad_start
+                    whisper.end[w_fir_i] = pad_start
 
                     # We inserted a new pad word, so we need to adjust all the match indices by 1
                     matches_w = [(w + 1) for w in matches_w]
@@ -431,7 +870,7 @@ def get_karaoke_lines(m_path: str, w_path: str, lyrics_dir: str) -> str:
                     while syl_i < fir_syl_dif:
                         w_word_index = w_word_i - w_line_len + word_i + 1
                         # Start counting from one after the first word
-                        syl = count_syllables(whisper_words[w_word_index]["word"])
+                        syl = int(whisper.syllables[w_word_index])
 
                         # If word we're about to delete has extra syllables that go beyond the first musixmatch word's
                         # We split it to only delete the ones matched to the musixmatch word
@@ -439,27 +878,17 @@ def get_karaoke_lines(m_path: str, w_path: str, lyrics_dir: str) -> str:
                             extra_syl = (syl_i + syl) - fir_syl_dif
                             in_syl = syl - extra_syl
 
-                            break_word = whisper_words[w_word_index]
-
-                            extra_start = (
-                                (
-                                    (break_word["endTime"] - break_word["startTime"])
-                                    / syl
-                                )
-                                * in_syl
-                            ) + break_word["startTime"]
-                            extra_word = {
-                                "word": "pad" * extra_syl,
-                                "startTime": extra_start,
-                                "endTime": break_word["endTime"],
-                            }
+                            break_start = int(whisper.start[w_word_index])
+                            break_end = int(whisper.end[w_word_index])
+
+                            extra_start = round(
+                                (((break_end - break_start) / syl) * in_syl) + break_start
+                            )
 
                             # Adjust the first word to end where the pad begins since we deleted a bunch between them
-                            whisper_words[w_word_i - w_line_len][
-                                "endTime"
-                            ] = extra_start
+                            whisper.end[w_word_i - w_line_len] = extra_start
 
-                            whisper_words.insert(w_word_index + 1, extra_word)
+                            insert_pad(w_word_index + 1, extra_syl, extra_start, break_end)
                             matches_w = [(w + 1) for w in matches_w]
 
                         # Should only ever have one element, only one word can be split on musixmatch syllable border
@@ -470,7 +899,7 @@ def get_karaoke_lines(m_path: str, w_path: str, lyrics_dir: str) -> str:
 
                     # Delete them in reverse order to not throw off the indices
                     for index in sorted(w_indices_deleted, reverse=True):
-                        del whisper_words[index]
+                        whisper.delete(index)
                         w_word_i -= 1
                         w_line_len -= 1
 
@@ -485,6 +914,14 @@ def get_karaoke_lines(m_path: str, w_path: str, lyrics_dir: str) -> str:
 
         return m_words_matches, w_words_matches
 
+    def insert_pad(index, syllables, start_time, end_time):
+        # Pad words stand in for the syllables of a whisper word that was split at a line start
+        pad = "pad" * syllables
+        token = tokenize(pad)
+        whisper.insert(index, pad, token.id, token.syllables, start_time, end_time)
+
+    trim_token_ids()
+
     # GET LYRICS FROM JSON FILES
     with open(m_path, "r") as m:
         mjson = m.read().rstrip()
@@ -495,171 +932,37 @@ def get_karaoke_lines(m_path: str, w_path: str, lyrics_dir: str) -> str:
     musixmatch_data = json.loads(mjson)
     whisper_data = json.loads(wjson)
 
-    musixmatch_lines, musixmatch_words, musixmatch_line_indices = get_musixmatch_data(
-        musixmatch_data
-    )
-    whisper_words = get_whisper_words(whisper_data)
-    whisper_line_indices = get_whisper_line_breaks(whisper_words, musixmatch_lines)
-    whisper_lines = get_lines(whisper_words, whisper_line_indices)
+    musixmatch = get_musixmatch_timeline(musixmatch_data)
+    whisper = get_whisper_timeline(whisper_data)
 
     # Match whisper words to musixmatch words similar to greatest common subsequence
 
-    m_matches, w_matches = get_word_match_indices(
-        musixmatch_lines, whisper_lines, musixmatch_words, whisper_words
+    if mode == "song":
+        m_matches, w_matches = get_banded_word_matches(musixmatch, whisper)
+    else:
+        line_starts = musixmatch.line_indices[:-1]
+        whisper_line_indices = find_line_breaks(
+            whisper.start.tolist(),
+            whisper.ids.tolist(),
+            musixmatch.start[line_starts].tolist(),
+            musixmatch.ids[line_starts].tolist(),
+        )
+
+        m_matches, w_matches = get_word_match_indices(whisper_line_indices)
+
+    # How well the transcription fits the lyrics, benchmark.py reads this to compare whisper profiles
+    print("Matched {} of {} lyric words".format(len(m_matches), len(musixmatch)))
+
+    interpolate_gap_times(
+        musixmatch,
+        whisper,
+        m_matches,
+        w_matches,
+        int(musixmatch_data["lines"][-1]["startTimeMs"]),
     )
 
-    m_gap_indices = []
-    w_gap_indices = []
-
-    prev_i = 0
-    # + 1 in case the last match happens before the end of the lyrics, so we can check gap after the last match
-    for i in range(len(m_matches) + 1):
-        # Assign time stamps for the perfectly matched words
-        if i < len(m_matches):
-            musixmatch_words[m_matches[i]]["startTime"] = whisper_words[w_matches[i]][
-                "startTime"
-            ]
-            musixmatch_words[m_matches[i]]["endTime"] = whisper_words[w_matches[i]][
-                "endTime"
-            ]
-
-        m_gap_indices = [
-            x
-            for x in range(
-                m_matches[prev_i] + 1 if not (prev_i == 0 and i == 0) else 0,
-                m_matches[i] if i < len(m_matches) else len(musixmatch_words),
-            )
-        ]
-        w_gap_indices = [
-            x
-            for x in range(
-                w_matches[prev_i] + 1 if not (prev_i == 0 and i == 0) else 0,
-                w_matches[i] if i < len(w_matches) else len(whisper_words),
-            )
-        ]
-
-        # Assign time stamps for the gap words
-
-        if len(m_gap_indices) != 0:
-            m_syl_total = 0
-            m_syl_indices = []
-
-            w_syl_total = 0
-            w_syl_indices = []
-
-            for m_gap_i in m_gap_indices:
-                m_syl_indices.append(m_syl_total)
-                m_syl_total += count_syllables(musixmatch_words[m_gap_i]["word"])
-
-            for w_gap_i in w_gap_indices:
-                w_syl_indices.append(w_syl_total)
-                w_syl_total += count_syllables(whisper_words[w_gap_i]["word"])
-
-            # Generate a timestamp for every syllable possible in gap space
-
-            w_syl_timestamps = []
-
-            m_gaps = []
-            w_gaps = []
-            for index in m_gap_indices:
-                m_gaps.append(musixmatch_words[index])
-            for index in w_gap_indices:
-                w_gaps.append(whisper_words[index])
-
-            # Generate timestamps for whisper by breaking words into syllables, interpolating between words by syllables
-            for w_word in w_gaps:
-                w_word_syl_count = count_syllables(w_word["word"])
-
-                for syl_i in range(w_word_syl_count):
-                    syl_start_time = (
-                        ((w_word["endTime"] - w_word["startTime"]) / w_word_syl_count)
-                        * syl_i
-                    ) + w_word["startTime"]
-                    syl_end_time = (
-                        ((w_word["endTime"] - w_word["startTime"]) / w_word_syl_count)
-                        * (syl_i + 1)
-                    ) + w_word["startTime"]
-
-                    w_syl_timestamps.append(
-                        {"startTime": syl_start_time, "endTime": syl_end_time}
-                    )
-
-            # Some of the musixmatch syllables don't have a corresponding syllable in whisper
-            if m_syl_total > w_syl_total:
-                prev_border_i = w_matches[prev_i] + len(w_gap_indices)
-                next_border_i = (
-                    w_matches[i] if i < len(w_matches) else len(whisper_words)
-                )
-
-                # If the first musixmatch words are unmatched, we guess where the start the start of the line is
-                # by taking the first detected whisper word - (the length of the first word * number of missing words)
-                # This cannot be earlier that 0, the start of the song
-                w_first_syl = count_syllables(whisper_words[0]["word"])
-                w_last_syl = count_syllables(whisper_words[-1]["word"])
-                w_first_syl_length = (
-                    whisper_words[0]["endTime"] - whisper_words[0]["startTime"]
-                ) / w_first_syl
-                w_last_syl_length = (
-                    whisper_words[-1]["endTime"] - whisper_words[-1]["startTime"]
-                ) / w_last_syl
-
-                prev_border = (
-                    whisper_words[prev_border_i]["endTime"]
-                    if not (prev_border_i == 0 and next_border_i == 0)
-                    else max(
-                        min(
-                            musixmatch_words[0]["startTime"],
-                            whisper_words[0]["startTime"]
-                            - ((m_syl_total - w_syl_total) * w_first_syl_length),
-                        ),
-                        0,
-                    )
-                )
-
-                # If the last musixmatch words are unmatched, we calculate the end border in a similar way
-                # Should also make it not go past the end of the song
-                next_border = (
-                    whisper_words[next_border_i]["startTime"]
-                    if next_border_i < len(whisper_words)
-                    else max(
-                        whisper_words[-1]["endTime"]
-                        + w_last_syl_length * (m_syl_total - w_syl_total),
-                        int(musixmatch_data["lines"][-1]["startTimeMs"]),
-                    )
-                )
-
-                # Generate extra timestamps for syllables that go beyond how many words whisper has
-                for extra_i in range(m_syl_total - w_syl_total):
-                    syl_start_time = (
-                        ((next_border - prev_border) / (m_syl_total - w_syl_total))
-                        * extra_i
-                    ) + prev_border
-                    syl_end_time = (
-                        ((next_border - prev_border) / (m_syl_total - w_syl_total))
-                        * (extra_i + 1)
-                    ) + prev_border
-
-                    w_syl_timestamps.append(
-                        {"startTime": syl_start_time, "endTime": syl_end_time}
-                    )
-
-            # Debug the words in every gap
-
-            # m_gap_words = [musixmatch_words[i]["word"] for i in m_gap_indices]
-            # w_gap_words = [whisper_words[i]["word"] for i in w_gap_indices]
-            # print(m_gap_words)
-            # print(w_gap_words)
-
-            # Assign timestamps to the unmatched musixmatch words from whisperwords by syllable count
-            for syl_i, gap_i in enumerate(m_gap_indices):
-                # print(str(len(w_syl_timestamps)) + " " + str(syl_i))
-                musixmatch_words[gap_i]["startTime"] = w_syl_timestamps[syl_i]["startTime"]
-                musixmatch_words[gap_i]["endTime"] = w_syl_timestamps[syl_i]["endTime"]
-
-        prev_i = i
-
     # Now, break the words back into lines
-    karaoke_lines = get_lines(musixmatch_words, musixmatch_line_indices)
+    karaoke_lines = musixmatch.to_lines()
 
     # Check the final lines
 
@@ -674,9 +977,10 @@ def get_karaoke_lines(m_path: str, w_path: str, lyrics_dir: str) -> str:
 
     #     print(k_line_string)
 
-    with open(karaoke_path, "w") as f:
-        json.dump(karaoke_lines, f)
-        print("Writing word-level timestamped lyrics json to " + karaoke_path)
+    write_json_atomic(karaoke_path, karaoke_lines)
+    print("Writing word-level timestamped lyrics json to " + karaoke_path)
+
+    save_guess_cache()
 
     return karaoke_path
 
@@ -0,0 +1,159 @@
+import gc
+import os
+import threading
+import time
+from typing import NamedTuple, Optional, Union
+
+import torch
+import whisperx
+
+# Seconds a model may sit unused before it's unloaded to reclaim memory, 0 keeps models loaded forever
+MODEL_IDLE_TIMEOUT = float(os.environ.get("MODEL_IDLE_TIMEOUT", 0))
+
+
+class ModelPool:
+    """
+    Keeps loaded models in memory for the life of the worker process, so every request after the first reuses them.
+    Models are keyed by whatever identifies their configuration, e.g. ("whisper", "large-v2", "cpu", "int8").
+    If idle_timeout is set, models that haven't been used for that many seconds are unloaded.
+    """
+
+    def __init__(self, idle_timeout: float = MODEL_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.models = {}
+        self.last_used = {}
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def get(self, key, load):
+        """Return the model for key, calling load() to create it if it isn't loaded yet, and the seconds spent loading."""
+        with self.lock:
+            load_time = 0.0
+
+            if key not in self.models:
+                print("Loading model " + str(key) + "...")
+                start = time.perf_counter()
+                self.models[key] = load()
+                load_time = time.perf_counter() - start
+                print("Loaded model {} in {:.1f}s".format(key, load_time))
+
+            self.last_used[key] = time.monotonic()
+            self.schedule_eviction()
+
+            return self.models[key], load_time
+
+    def schedule_eviction(self):
+        if self.idle_timeout <= 0 or self.timer is not None:
+            return
+
+        self.timer = threading.Timer(self.idle_timeout, self.evict_idle)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def evict_idle(self):
+        """Unload every model that has been idle for longer than idle_timeout."""
+        with self.lock:
+            self.timer = None
+            now = time.monotonic()
+
+            for key in [k for k, used in self.last_used.items() if now - used >= self.idle_timeout]:
+                print("Unloading idle model " + str(key) + "...")
+                del self.models[key]
+                del self.last_used[key]
+
+            if len(self.models) != 0:
+                self.schedule_eviction()
+
+        free_memory()
+
+    def clear(self):
+        """Unload every model."""
+        with self.lock:
+            self.models.clear()
+            self.last_used.clear()
+
+        free_memory()
+
+
+def free_memory():
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+pool = ModelPool()
+
+
+def get_device() -> str:
+    # Default to CPU if no compatible GPU detected
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+class WhisperProfile(NamedTuple):
+    """
+    How to run WhisperX: model size, compute type, transcription batch size,
+    and CPU threads (0 uses every core).
+    """
+
+    size: str
+    compute_type: str
+    batch_size: int
+    threads: int = 0
+
+
+WHISPER_PROFILES = {
+    "gpu": WhisperProfile("large-v2", "float16", 16),
+    "gpu-low-mem": WhisperProfile("large-v2", "int8", 8),
+    "cpu": WhisperProfile("large-v2", "int8", 16),
+    "cpu-low-mem": WhisperProfile("medium", "int8", 8),
+    "cpu-fast": WhisperProfile("small", "int8", 8),
+}
+
+
+def get_whisper_profile(profile: Optional[Union[str, WhisperProfile]] = None) -> WhisperProfile:
+    """
+    Resolve the WhisperX profile for a request.
+    A profile passed for the request wins. Otherwise the WHISPER_PROFILE environment variable picks one by name
+    ("gpu" or "cpu" by default, depending on the device), and WHISPER_MODEL_SIZE, WHISPER_COMPUTE_TYPE,
+    WHISPER_BATCH_SIZE and WHISPER_THREADS override single fields of it.
+    """
+    if isinstance(profile, WhisperProfile):
+        return profile
+    if profile is not None:
+        return WHISPER_PROFILES[profile]
+
+    name = os.environ.get("WHISPER_PROFILE", "gpu" if get_device() == "cuda" else "cpu")
+    profile = WHISPER_PROFILES[name]
+
+    return profile._replace(
+        size=os.environ.get("WHISPER_MODEL_SIZE", profile.size),
+        compute_type=os.environ.get("WHISPER_COMPUTE_TYPE", profile.compute_type),
+        batch_size=int(os.environ.get("WHISPER_BATCH_SIZE", profile.batch_size)),
+        threads=int(os.environ.get("WHISPER_THREADS", profile.threads)),
+    )
+
+
+def get_whisper_model(profile: WhisperProfile, device: str):
+    """WhisperX transcription model and the seconds spent loading it (0 if it was already loaded)."""
+    threads = profile.threads or os.cpu_count()
+    return pool.get(
+        ("whisper", profile.size, device, profile.compute_type, threads),
+        lambda: whisperx.load_model(
+            profile.size, device, compute_type=profile.compute_type, language="en", threads=threads
+        ),
+    )
+
+
+def get_align_model(device: str):
+    """WhisperX alignment model and its metadata, and the seconds spent loading them (0 if already loaded)."""
+    return pool.get(
+        ("align", "en", device),
+        lambda: whisperx.load_align_model(language_code="en", device=device),
+    )
+
+
+def warm_up(profile: WhisperProfile):
+    """Load the transcription and alignment models at startup so the first request doesn't pay for it."""
+    device = get_device()
+    get_whisper_model(profile, device)
+    get_align_model(device)
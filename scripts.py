@@ -1,17 +1,43 @@
 import re
 import os
+import time
 import whisperx
 import json
+import numpy as np
 import torch
-import requests
 from pathlib import Path
-from typing import Tuple
+from typing import Optional, Tuple, Union
 
-from pytube import Search
 from spleeter.separator import Separator
 
+from artifacts import artifact_key, artifacts, hash_bytes, hash_file
+from lyrics import lyrics_client
+from manifest import write_json_atomic
+from youtube import download_audio, find_video, search_youtube
+from match_words import get_karaoke_lines, get_musixmatch_timeline
+from vad import VAD_GATE, VAD_MIN_SILENCE_MS, VAD_PAD_MS, VAD_THRESHOLD_DB, find_sung_regions, join_regions, restore_timestamps
+from separation import (
+    SAMPLE_RATE, SPLEETER_CHUNK_SECONDS, SPLEETER_OVERLAP_SECONDS, WHISPER_SAMPLE_RATE, StemWriter, WhisperStem, separate_chunked,
+)
+from models import WhisperProfile, get_align_model, get_device, get_whisper_model, get_whisper_profile, warm_up
+
 separator = Separator("spleeter:2stems")
 
+# "transcribe" runs Whisper on the vocals and matches its words to the lyrics afterwards,
+# "lyrics" force-aligns the Musixmatch lyrics to the vocals directly and only transcribes if that fails
+WHISPER_MODE = os.environ.get("WHISPER_MODE", "transcribe")
+# Forced alignments below this mean word score are thrown away
+ALIGN_MIN_SCORE = float(os.environ.get("ALIGN_MIN_SCORE", 0.5))
+# Forced alignments that leave more than this fraction of the words without timestamps are thrown away
+ALIGN_MAX_UNALIGNED = float(os.environ.get("ALIGN_MAX_UNALIGNED", 0.1))
+# Seconds every lyric line is widened by on either side for forced alignment, Musixmatch's line times are rough
+ALIGN_LINE_MARGIN = 0.5
+# "lines" matches the transcription to the lyrics line by line, "song" matches the whole song at once, see
+# match_words.get_karaoke_lines
+MATCH_MODE = os.environ.get("MATCH_MODE", "lines")
+# "python" or "numpy" fill of the word alignment tables, they give the same matches
+MATCH_ENGINE = os.environ.get("MATCH_ENGINE", "python")
+
 
 def get_title(
     name: str,
@@ -31,87 +57,133 @@ def get_title(
 
     return title
 
-def download_and_split(title, length: int, pytube_dir: str, spleeter_dir: str, MAX_TIME_DIF: int = 2) -> Tuple[str, str]:
-    """Downloads a song from YouTube and splits into 2 stems. Returns path to vocals and accompaniment audio files."""
+def download(title, length: int, pytube_dir: str, MAX_TIME_DIF: int = 2, search=search_youtube) -> Optional[str]:
+    """
+    Downloads a song from YouTube. Returns path to the audio file, or None if no video matched.
+    search is the search backend, see youtube.search_youtube.
+    """
+
+    song_path = os.path.join(pytube_dir, title)
+    if os.path.exists(song_path):
+        print("Downloaded song already exists. Returning path.")
+        return song_path
+
+    # Search YouTube for first result matching search query that has a duration
+    # within max_time_dif seconds of Spotify's listed duration for the song
+    video = find_video(title, length, MAX_TIME_DIF, search)
+    if video is None:
+        return None
+
+    print("Downloading to " + song_path)
+    # Download under a temporary name so an interrupted download is never mistaken for a finished one
+    download_audio(video, song_path + ".part")
+    os.replace(song_path + ".part", song_path)
+    return song_path
+
+
+def split(song_path: str, title, spleeter_dir: str) -> Tuple[np.ndarray, str]:
+    """
+    Splits a song into 2 stems. Returns the vocals as a 16 kHz mono waveform, ready for WhisperX,
+    and the path to the accompaniment audio file.
+    Songs are separated in windows of SPLEETER_CHUNK_SECONDS to bound memory, or all at once if that's 0.
+    Stems are cached by the hash of the song's audio, so the same recording is only ever separated once.
+    """
 
-    vocals_path = os.path.join(spleeter_dir, title, "vocals.wav")
     accompaniment_path = os.path.join(spleeter_dir, title, "accompaniment.wav")
+    vocals_path = os.path.join(spleeter_dir, title, "vocals.npy")
+    Path(accompaniment_path).parent.mkdir(parents=True, exist_ok=True)
+
+    key = artifact_key("stems", hash_file(song_path), SPLEETER_CHUNK_SECONDS, SPLEETER_OVERLAP_SECONDS)
+    if artifacts.get(key, "accompaniment.wav", accompaniment_path) and artifacts.get(key, "vocals.npy", vocals_path):
+        return np.load(vocals_path), accompaniment_path
+
+    vocals = WhisperStem()
 
-    if os.path.exists(vocals_path) and os.path.exists(accompaniment_path):
-        print("Spleeter stem files already exist. Returning path.")
-        return vocals_path, accompaniment_path
+    print("separating " + song_path + " to 2 stems at " + spleeter_dir)
+    # Written under a temporary name and renamed once complete. Renaming also replaces rather than overwrites
+    # a stem linked from the cache, which shares its file with the cached artifact
+    separate_chunked(separator, song_path, {"vocals": vocals, "accompaniment": StemWriter(accompaniment_path + ".tmp")})
+    os.replace(accompaniment_path + ".tmp", accompaniment_path)
 
-    s = Search(title)
-    for video in s.results:
-        # Search YouTube for first result matching search query that has a duration
-        # within max_time_dif seconds of Spotify's listed duration for the song
-        if abs(video.length - length) < MAX_TIME_DIF:
-            streams = video.streams.filter(only_audio=True)
+    vocals = vocals.waveform()
+    np.save(vocals_path, vocals)
+    artifacts.put(key, "accompaniment.wav", accompaniment_path)
+    artifacts.put(key, "vocals.npy", vocals_path)
 
-            song_path = os.path.join(pytube_dir, title)
+    print("returning stems...")
+    return vocals, accompaniment_path
 
-            if not os.path.exists(song_path):
-                print("Downloading to " + song_path)
-                song_path = streams[0].download(pytube_dir, title)
 
-            print("separating " + song_path + " to 2 stems at " + spleeter_dir)
-            separator.separate_to_file(song_path, spleeter_dir)
+def download_and_split(title, length: int, pytube_dir: str, spleeter_dir: str, MAX_TIME_DIF: int = 2) -> Tuple[np.ndarray, str]:
+    """Downloads a song from YouTube and splits into 2 stems. Returns the vocals waveform and path to the accompaniment audio file."""
 
-            print("returning stem locations...")
-            return vocals_path, accompaniment_path
+    song_path = download(title, length, pytube_dir, MAX_TIME_DIF)
+    if song_path is not None:
+        return split(song_path, title, spleeter_dir)
 
 
 def get_musixmatch(track_id: str, lyrics_dir: str):
-    """Retrieves the musixmatch lyrics, downloads to a json file, and returns the path."""
+    """
+    Retrieves the musixmatch lyrics, downloads to a json file, and returns the path.
+    Raises lyrics.LyricsNotFound if the track has no synced lyrics.
+    """
     musixmatch_path = os.path.join(lyrics_dir, "musixmatch.json")
 
     if os.path.exists(musixmatch_path):
         print("Musixmatch lyrics json already exists. Returning path.")
         return musixmatch_path
 
-    res = requests.get(f"https://spotify-lyric-api-984e7b4face0.herokuapp.com/?trackid={track_id}")
-    musixmatch_lyrics = res.json()
+    musixmatch_lyrics = lyrics_client.get(track_id)
 
-    with open(musixmatch_path, "w") as f:
-        json.dump(musixmatch_lyrics, f)
-        print("Writing musixmatch lyrics json to " + musixmatch_path)
+    write_json_atomic(musixmatch_path, musixmatch_lyrics)
+    print("Writing musixmatch lyrics json to " + musixmatch_path)
 
     return musixmatch_path
 
 
-def get_whisper(speech_audio_file: str, lyrics_dir: str) -> str:
-    whisper_path = os.path.join(lyrics_dir, "whisper.json")
+def warm_up_whisper(profile: Optional[Union[str, WhisperProfile]] = None):
+    """Load the WhisperX models into the worker's model pool ahead of the first request."""
+    if get_device() == "cpu":
+        print("No CUDA device detected. Running on CPU!")
+    warm_up(get_whisper_profile(profile))
 
-    if os.path.exists(whisper_path):
-        print("Whisper transcription json already exists. Returning path.")
-        return whisper_path
 
-    device = "cuda"
-    batch_size = 16  # reduce if low on GPU mem
-    compute_type = "float16"  # change to "int8" if low on GPU mem (may reduce accuracy)
-    size = "large-v2" # change to "medium" if low on memory
+def warm_up_workers(profile: Optional[Union[str, WhisperProfile]] = None):
+    """Load every model a worker process uses: WhisperX, and Spleeter by separating a second of silence."""
+    warm_up_whisper(profile)
+    separator.separate(np.zeros((SAMPLE_RATE, 2), dtype=np.float32))
 
-    # Default to CPU if no compatible GPU detected
-    if not torch.cuda.is_available():
-        device = "cpu"
-        print("No CUDA device detected. Running on CPU!")
-        compute_type = "int8"
-        size = "large-v2"
 
-    # 1. Transcribe with original whisper (batched)file:///home/jason/Downloads/call-me-maybe.mp3
+def transcribe_and_align(audio: np.ndarray, profile: WhisperProfile, device: str) -> list[dict]:
+    """Transcribes the vocals with Whisper and aligns the transcription with WhisperX, returns the segments."""
+    print("Running WhisperX with " + str(profile))
+
+    if device == "cpu" and profile.threads:
+        torch.set_num_threads(profile.threads)
+
+    # 1. Transcribe with original whisper (batched)
+    # Models are loaded once per worker process and reused across requests
 
-    model = whisperx.load_model(size, device, compute_type=compute_type, language="en")
+    model, model_load_time = get_whisper_model(profile, device)
 
-    audio = whisperx.load_audio(speech_audio_file)
-    result = model.transcribe(audio, batch_size=batch_size, language="en")
+    start = time.perf_counter()
 
-    # delete model if low on GPU resources
-    # gc.collect()
-    # torch.cuda.empty_cache()
-    # del model
+    # Skip the instrumental stretches, where the vocal stem is close to silent
+    regions = find_sung_regions(audio) if VAD_GATE else []
+    if len(regions) != 0:
+        song_length = len(audio)
+        audio, joined_starts, original_starts = join_regions(audio, regions)
+        print("Transcribing {:.0f}s with singing out of {:.0f}s".format(
+            len(audio) / WHISPER_SAMPLE_RATE, song_length / WHISPER_SAMPLE_RATE
+        ))
+
+    result = model.transcribe(audio, batch_size=profile.batch_size, language="en")
+    transcribe_time = time.perf_counter() - start
 
     # 2. Align whisper output
-    model_a, metadata = whisperx.load_align_model(language_code="en", device=device)
+    (model_a, metadata), align_load_time = get_align_model(device)
+
+    start = time.perf_counter()
     result = whisperx.align(
         result["segments"],
         model_a,
@@ -120,12 +192,125 @@ def get_whisper(speech_audio_file: str, lyrics_dir: str) -> str:
         device,
         return_char_alignments=False,
     )
+    align_time = time.perf_counter() - start
+
+    if len(regions) != 0:
+        restore_timestamps(result["segments"], joined_starts, original_starts)
+
+    print(
+        "Whisper timings: model load {:.1f}s, transcription {:.1f}s, align model load {:.1f}s, alignment {:.1f}s".format(
+            model_load_time, transcribe_time, align_load_time, align_time
+        )
+    )
+
+    return result["segments"]
+
+
+def get_lyric_segments(musixmatch_path: str, song_seconds: float) -> list[dict]:
+    """
+    The cleaned Musixmatch lyrics as WhisperX transcript segments, one per line, each spanning from the line's
+    start to the next line's start, widened by ALIGN_LINE_MARGIN.
+    """
+    with open(musixmatch_path, "r") as f:
+        musixmatch = get_musixmatch_timeline(json.load(f))
+
+    segments = []
+    for line_i in range(musixmatch.line_count()):
+        line = musixmatch.line(line_i)
+        next_start = int(musixmatch.start[line.stop]) / 1000 if line.stop < len(musixmatch) else song_seconds
+
+        segments.append({
+            "text": " ".join(musixmatch.words[line].tolist()),
+            "start": max(int(musixmatch.start[line.start]) / 1000 - ALIGN_LINE_MARGIN, 0),
+            "end": min(next_start + ALIGN_LINE_MARGIN, song_seconds),
+        })
+
+    return segments
+
+
+def force_align(audio: np.ndarray, musixmatch_path: str, device: str) -> Optional[list[dict]]:
+    """
+    Aligns the Musixmatch lyrics straight to the vocals with the WhisperX alignment model, without transcribing.
+    Returns the segments, or None if the alignment isn't confident enough to use: the words score below
+    ALIGN_MIN_SCORE on average, or more than ALIGN_MAX_UNALIGNED of them couldn't be placed.
+    """
+    (model_a, metadata), align_load_time = get_align_model(device)
+
+    start = time.perf_counter()
+    segments = get_lyric_segments(musixmatch_path, len(audio) / WHISPER_SAMPLE_RATE)
+    result = whisperx.align(segments, model_a, metadata, audio, device, return_char_alignments=False)
+    align_time = time.perf_counter() - start
+
+    words = [word for segment in result["segments"] for word in segment["words"]]
+    scores = [word["score"] for word in words if "start" in word]
+    unaligned = 1 - len(scores) / len(words) if len(words) != 0 else 1
+    score = sum(scores) / len(scores) if len(scores) != 0 else 0
+
+    print("Forced alignment: align model load {:.1f}s, alignment {:.1f}s, mean score {:.2f}, {:.0%} unaligned".format(
+        align_load_time, align_time, score, unaligned
+    ))
+
+    if score < ALIGN_MIN_SCORE or unaligned > ALIGN_MAX_UNALIGNED:
+        print("Forced alignment isn't confident enough, transcribing instead")
+        return None
+
+    return result["segments"]
+
+
+def get_whisper(
+    speech_audio: Union[str, np.ndarray],
+    lyrics_dir: str,
+    profile: Optional[Union[str, WhisperProfile]] = None,
+    musixmatch_path: Optional[str] = None,
+) -> str:
+    """
+    Transcribes and aligns the vocals with WhisperX, writes the segments to a json file, and returns the path.
+    speech_audio is either a path to the vocals or the 16 kHz mono waveform split() returns.
+    profile overrides the configured WhisperProfile (model size, compute type, batch size, threads) for this request.
+    If musixmatch_path is given, the lyrics are force-aligned to the vocals instead, see force_align,
+    and the vocals are only transcribed if that fails.
+    """
+    whisper_path = os.path.join(lyrics_dir, "whisper.json")
+
+    if os.path.exists(whisper_path):
+        print("Whisper transcription json already exists. Returning path.")
+        return whisper_path
+
+    device = get_device()
+    profile = get_whisper_profile(profile)
+    audio = whisperx.load_audio(speech_audio) if isinstance(speech_audio, str) else speech_audio
+
+    # Everything the transcription depends on
+    key = artifact_key(
+        "whisper", hash_bytes(audio), tuple(profile), device,
+        hash_file(musixmatch_path) if musixmatch_path is not None else None,
+        VAD_GATE, VAD_THRESHOLD_DB, VAD_MIN_SILENCE_MS, VAD_PAD_MS,
+    )
+    if artifacts.get(key, "whisper.json", whisper_path):
+        return whisper_path
+
+    segments = force_align(audio, musixmatch_path, device) if musixmatch_path is not None else None
+    if segments is None:
+        segments = transcribe_and_align(audio, profile, device)
 
-    with open(whisper_path, "w") as f:
-        json.dump(result["segments"], f)
-        print("Writing whisper transcription json to " + whisper_path)
+    write_json_atomic(whisper_path, segments)
+    print("Writing whisper transcription json to " + whisper_path)
 
+    artifacts.put(key, "whisper.json", whisper_path)
     return whisper_path
 
 
+def align_lyrics(musixmatch_path: str, whisper_path: str, lyrics_dir: str) -> str:
+    """match_words.get_karaoke_lines, cached by the lyrics and transcription it's made from."""
+    karaoke_path = os.path.join(lyrics_dir, "karaoke.json")
+
+    key = artifact_key("karaoke", hash_file(musixmatch_path), hash_file(whisper_path), MATCH_MODE, MATCH_ENGINE)
+    if artifacts.get(key, "karaoke.json", karaoke_path):
+        return karaoke_path
+
+    karaoke_path = get_karaoke_lines(musixmatch_path, whisper_path, lyrics_dir, engine=MATCH_ENGINE, mode=MATCH_MODE)
+    artifacts.put(key, "karaoke.json", karaoke_path)
+    return karaoke_path
+
+
 # get_musixmatch("3TGRqZ0a2l1LRblBkJoaDx")
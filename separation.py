@@ -0,0 +1,118 @@
+import math
+import os
+import wave
+from pathlib import Path
+
+import ffmpeg
+import numpy as np
+from scipy.signal import resample_poly
+from spleeter.audio.adapter import AudioAdapter
+
+# Spleeter's models work on 44.1 kHz stereo
+SAMPLE_RATE = 44100
+# WhisperX transcribes 16 kHz mono
+WHISPER_SAMPLE_RATE = 16000
+# Seconds of audio separated at once, which bounds memory regardless of the song's length. 0 separates the whole song
+SPLEETER_CHUNK_SECONDS = float(os.environ.get("SPLEETER_CHUNK_SECONDS", 60))
+# Seconds each chunk overlaps the next by, cross-faded so there's no click at the seams
+SPLEETER_OVERLAP_SECONDS = float(os.environ.get("SPLEETER_OVERLAP_SECONDS", 2))
+
+
+def get_duration(path: str) -> float:
+    """Length of an audio file in seconds, read from its header."""
+    return float(ffmpeg.probe(path)["format"]["duration"])
+
+
+class StemWriter:
+    """Appends stereo float waveforms to a 16 bit WAV file as they're produced, so the whole stem is never in memory."""
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.file = wave.open(path, "wb")
+        self.file.setnchannels(2)
+        self.file.setsampwidth(2)
+        self.file.setframerate(SAMPLE_RATE)
+
+    def write(self, waveform: np.ndarray):
+        samples = (np.clip(waveform, -1, 1) * 32767).astype("<i2")
+        self.file.writeframes(samples.tobytes())
+
+    def close(self):
+        self.file.close()
+
+
+class WhisperStem:
+    """
+    Keeps a stem in memory as the 16 kHz mono float32 waveform WhisperX transcribes, resampled as it's produced,
+    instead of writing it to disk for whisperx.load_audio to decode again with ffmpeg.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        divisor = math.gcd(WHISPER_SAMPLE_RATE, SAMPLE_RATE)
+        self.up, self.down = WHISPER_SAMPLE_RATE // divisor, SAMPLE_RATE // divisor
+
+    def write(self, waveform: np.ndarray):
+        mono = waveform.mean(axis=1)
+        self.chunks.append(resample_poly(mono, self.up, self.down).astype(np.float32))
+
+    def close(self):
+        pass
+
+    def waveform(self) -> np.ndarray:
+        return np.concatenate(self.chunks) if self.chunks else np.zeros(0, dtype=np.float32)
+
+
+def separate_chunked(
+    separator,
+    song_path: str,
+    stems: dict,
+    chunk_seconds: float = SPLEETER_CHUNK_SECONDS,
+    overlap_seconds: float = SPLEETER_OVERLAP_SECONDS,
+):
+    """
+    Separate song_path with a Spleeter separator one window at a time and write each stem to stems[stem],
+    a StemWriter or WhisperStem. Stems missing from stems are dropped.
+    Windows are chunk_seconds long plus overlap_seconds shared with the next window. The shared part is
+    cross-faded from the end of one window into the start of the next, and only the finished part of each
+    window is written, so memory stays bounded by the window size however long the song is.
+    A chunk_seconds of 0 or less separates the whole song as a single window.
+    """
+    audio_adapter = AudioAdapter.default()
+    duration = get_duration(song_path)
+    if chunk_seconds <= 0:
+        chunk_seconds = duration
+    overlap = int(overlap_seconds * SAMPLE_RATE)
+    fade_in = np.linspace(0, 1, overlap, dtype=np.float32)[:, np.newaxis]
+
+    # End of the previous window for every stem, waiting to be cross-faded into the next one
+    tails = {}
+    offset = 0.0
+
+    try:
+        while offset < duration:
+            waveform, _ = audio_adapter.load(
+                song_path, offset=offset, duration=chunk_seconds + overlap_seconds, sample_rate=SAMPLE_RATE
+            )
+            is_last = offset + chunk_seconds >= duration
+
+            for stem, data in separator.separate(waveform).items():
+                if stem not in stems:
+                    continue
+
+                if stem in tails:
+                    tail = tails.pop(stem)
+                    fade = min(len(tail), len(data))
+                    blended = tail[:fade] * (1 - fade_in[:fade]) + data[:fade] * fade_in[:fade]
+                    data = np.concatenate([blended, data[fade:]])
+
+                if is_last or len(data) <= overlap:
+                    stems[stem].write(data)
+                else:
+                    stems[stem].write(data[:-overlap])
+                    tails[stem] = data[-overlap:]
+
+            offset += chunk_seconds
+    finally:
+        for sink in stems.values():
+            sink.close()
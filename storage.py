@@ -0,0 +1,106 @@
+import os
+import time
+from typing import Optional, Sequence, Tuple, Union
+
+from botocore.exceptions import ClientError
+
+from audio import KARAOKE_BITRATE, AudioFormat, CountingReader, encode, get_audio_format
+
+# Error codes S3 answers with when an object doesn't exist, HEAD requests have no body so only the status comes back
+MISSING_CODES = {"404", "NoSuchKey", "NotFound"}
+# Seconds presigned karaoke track URLs stay valid
+URL_EXPIRY = 3600
+
+
+def object_exists(s3, bucket: str, key: str) -> bool:
+    """
+    Checks for an object with a HEAD request, which only fetches its metadata.
+    Returns False if it doesn't exist, any other error (permissions, throttling, network) is raised
+    so callers can tell "not there" apart from "couldn't check".
+    """
+    try:
+        s3.head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] in MISSING_CODES:
+            return False
+        raise
+
+
+def get_track_url(s3, bucket: str, track_key: str) -> str:
+    return s3.generate_presigned_url("get_object", Params={"Bucket": bucket, "Key": track_key}, ExpiresIn=URL_EXPIRY)
+
+
+def read_lyrics(s3, bucket: str, lyrics_key: str) -> str:
+    """The lyrics JSON stored at lyrics_key, read straight from the response body without a local file."""
+    print("Reading lyrics json from S3...")
+    return s3.get_object(Bucket=bucket, Key=lyrics_key)["Body"].read().decode("utf-8")
+
+
+def find_existing_karaoke(
+    s3, bucket: str, lyrics_key: str, track_key: str, legacy_track_keys: Sequence[str] = ()
+) -> Optional[Tuple[str, str]]:
+    """
+    Returns the URL to the karaoke track and the lyrics JSON if the track was already generated, otherwise None.
+    The track is uploaded after the lyrics, so its presence alone means the whole job finished
+    and one HEAD request answers the lookup. legacy_track_keys are where older versions uploaded the track,
+    e.g. in another format, each is checked in turn if track_key isn't there.
+    """
+    print("Looking for existing files on S3...")
+    for key in [track_key] + [key for key in legacy_track_keys if key != track_key]:
+        if object_exists(s3, bucket, key):
+            return get_track_url(s3, bucket, key), read_lyrics(s3, bucket, lyrics_key)
+
+    return None
+
+
+def upload_track(s3, bucket: str, wav_path: str, track_key: str, audio_format: AudioFormat, bitrate: str = KARAOKE_BITRATE):
+    """
+    Upload the karaoke track in audio_format. Compressed formats are encoded by ffmpeg and streamed to S3 as a
+    multipart upload while they're encoded, then the bytes saved over the WAV and the encode time are reported.
+    """
+    if audio_format.codec is None:
+        s3.upload_file(wav_path, bucket, track_key, ExtraArgs={"ContentType": audio_format.content_type})
+        return
+
+    start = time.perf_counter()
+    encoder = encode(wav_path, audio_format, bitrate)
+    encoded = CountingReader(encoder.stdout)
+
+    try:
+        s3.upload_fileobj(encoded, bucket, track_key, ExtraArgs={"ContentType": audio_format.content_type})
+    finally:
+        encoder.stdout.close()
+        error = encoder.stderr.read().decode("utf-8", "replace")
+        encoder.wait()
+
+    if encoder.returncode != 0:
+        # The upload only saw a truncated stream, don't leave it where lookups would take it for a finished track
+        s3.delete_object(Bucket=bucket, Key=track_key)
+        raise RuntimeError("ffmpeg failed to encode " + wav_path + ": " + error)
+
+    wav_size = os.path.getsize(wav_path)
+    print("Encoded {} to {} at {} in {:.1f}s: {:.1f} MB, {:.1f} MB ({:.0%}) smaller than the WAV".format(
+        wav_path, audio_format.extension, bitrate, time.perf_counter() - start, encoded.bytes_read / 1e6,
+        (wav_size - encoded.bytes_read) / 1e6, 1 - encoded.bytes_read / wav_size,
+    ))
+
+
+def upload_karaoke(
+    s3, bucket: str, lyrics_path: str, karaoke_track: str, lyrics_key: str, track_key: str,
+    audio_format: Optional[Union[str, AudioFormat]] = None,
+) -> Tuple[str, str]:
+    """
+    Uploads the lyrics and karaoke track files, lyrics first. Returns the URL to the karaoke track and the lyrics JSON,
+    which is read once and kept so the caller doesn't have to download it back.
+    karaoke_track is Spleeter's WAV, it's uploaded in audio_format (KARAOKE_FORMAT by default).
+    """
+    with open(lyrics_path, "r") as f:
+        lyrics = f.read()
+
+    print("Uploading lyric and karaoke track files...")
+    # Upload timestamped lyrics and voiceless accompaniment track
+    s3.put_object(Bucket=bucket, Key=lyrics_key, Body=lyrics.encode("utf-8"), ContentType="application/json")
+    upload_track(s3, bucket, karaoke_track, track_key, get_audio_format(audio_format))
+
+    return get_track_url(s3, bucket, track_key), lyrics
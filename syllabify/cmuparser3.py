@@ -3,7 +3,7 @@
     AC 2017-08-10: updated from Py2 original for Py3
     changes other than print() statements noted
 '''
-import os, re, random, types, functools
+import os, re, random, types, functools, pickle, tempfile
 
 # Settings 
 CMU_DIR = 'syllabify/CMU_dictionary' 
@@ -11,6 +11,8 @@ CMU_DIR = 'syllabify/CMU_dictionary'
 VERSION = 'cmudict.0.7a'
 # Path
 PATH_TO_DICTIONARY = os.path.join(CMU_DIR, (VERSION))
+# Compiled cache of the parsed dictionary, rebuilt whenever the source file changes
+CACHE_SUFFIX = '.pickle'
 
 ## Py2 -> Py3 problem: attempted fix for 'basestring' check in original script
 ## breaks: comment out check on basestring
@@ -32,7 +34,7 @@ else:
 ## original class
 class CMUDictionary(object):
     
-    def __init__(self, path_to_dictionary = PATH_TO_DICTIONARY):
+    def __init__(self, path_to_dictionary = PATH_TO_DICTIONARY, path_to_cache = None):
         
         self.regexp = re.compile(r'''
                         (?P<Comment>;;;.*) # ;;; denotes Comment: to be ignore
@@ -42,24 +44,61 @@ class CMUDictionary(object):
                         (?P<Phoneme> [^\n]+) # The remainder 
                      ''', re.VERBOSE)
         
-        # import CMU dictionary
-        try:
-            self.cmudict_file = open(path_to_dictionary)
-        except IOError as e:  # syntax change for Py3
-            print (e, 'file not found, check settings...')
-        # create Python CMU dictionary
-        self._cmudict = self._create_dictionary() 
-        self.cmudict_file.close()
+        self.path_to_dictionary = path_to_dictionary
+        self.path_to_cache = path_to_cache or path_to_dictionary + CACHE_SUFFIX
+        # Python CMU dictionary is only loaded on first lookup, so importing is cheap
+        self._cmudict = None
     
     def __getitem__(self, key):
         #if not isinstance(key, basestring):
             #raise KeyError('key must be of type: basestring')
+        if self._cmudict is None:
+            self._cmudict = self._load_dictionary()
         try:
-            return self._cmudict[key.upper()]  # ack: Dimitrios Alikaniotis https://gist.github.com/dimalik/440abc458fbcf4470171274d95efe67e
+            return Transcription(*self._cmudict[key.upper()])  # ack: Dimitrios Alikaniotis https://gist.github.com/dimalik/440abc458fbcf4470171274d95efe67e
             #return self._cmudict[key.encode('utf-8').upper()]
         except (KeyError, UnicodeDecodeError):
             return None
     
+    def _source_signature(self):
+        # size and modification time of the source file, used to invalidate the cache
+        stat = os.stat(self.path_to_dictionary)
+        return (VERSION, stat.st_size, stat.st_mtime_ns)
+    
+    def _load_dictionary(self):
+        try:
+            signature = self._source_signature()
+        except OSError as e:
+            print (e, 'file not found, check settings...')
+            return {}
+        
+        # Use the compiled cache if it was built from the current source file
+        try:
+            with open(self.path_to_cache, 'rb') as cache_file:
+                cache_signature, dictionary = pickle.load(cache_file)
+            if cache_signature == signature:
+                return dictionary
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            pass
+        
+        # import CMU dictionary
+        with open(self.path_to_dictionary) as cmudict_file:
+            self.cmudict_file = cmudict_file
+            dictionary = self._create_dictionary()
+        self._write_cache(signature, dictionary)
+        return dictionary
+    
+    def _write_cache(self, signature, dictionary):
+        # Write to a temp file and rename so concurrent workers never read a partial cache
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path_to_cache) or '.')
+            with os.fdopen(fd, 'wb') as tmp_file:
+                pickle.dump((signature, dictionary), tmp_file, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path_to_cache)
+        except OSError as e:
+            # Read-only install: keep working from the parsed source
+            print (e, 'could not write CMU dictionary cache')
+    
     def _create_dictionary(self):
         dict_temp = {}
         for line in self.cmudict_file.readlines():    
@@ -75,21 +114,21 @@ class CMUDictionary(object):
         
         if match.group('Word') and (match.group('Alternative') == None):
             # This is a new word
-            # Create an an entry, and instantiate a Transcription object
-            dictionary[match.group('Word')] = Transcription(match.group('Phoneme'))
+            # Create an an entry, stored as a tuple of phoneme strings to keep the cache compact
+            dictionary[match.group('Word')] = (match.group('Phoneme'),)
             return dictionary
         
         if match.group('Word') and match.group('Alternative'):
             # There is an alternative phenome representation of the metched word
             # Append phenome rep. to dictioanry entry for this word
-            dictionary[match.group('Word')].append(match.group('Phoneme'))            
+            dictionary[match.group('Word')] += (match.group('Phoneme'),)
             return dictionary
 
 class Transcription(object):
     # load dictionary
     # the phoneme transcription of the word
-    def __init__(self, phoneme, word=None):
-        self.representation = [Phoneme(phoneme)]
+    def __init__(self, phoneme, *alternatives, word=None):
+        self.representation = [Phoneme(phoneme)] + [Phoneme(x) for x in alternatives]
     def __len__(self):
         return len(self.representation)
     def __str__(self):
@@ -107,7 +146,7 @@ class Phoneme(object):
         return str(self.phoneme)
 
 
-## create dictionary
+## create dictionary (parsed lazily on first lookup)
 cmudict = CMUDictionary()
 
 
@@ -0,0 +1,111 @@
+import json
+import os
+import re
+from functools import lru_cache
+
+from manifest import write_json_atomic
+from syllabify.cmuparser3 import CMUtranscribe
+
+# Number of distinct normalized words whose syllable counts are kept in memory
+SYLLABLE_CACHE_SIZE = int(os.environ.get("SYLLABLE_CACHE_SIZE", 16384))
+# Where guesses for words missing from the CMU dictionary are persisted between runs
+GUESS_CACHE_PATH = os.environ.get("SYLLABLE_GUESS_CACHE", "syllable_guesses.json")
+
+# Placeholder words alignment pads whisper with, "pad" once per syllable. Not worth persisting
+PAD_WORD = re.compile(r"(pad)+")
+
+_guess_cache = None
+_guess_cache_dirty = False
+
+
+def normalize_word(word: str) -> str:
+    """Strip punctuation (except apostrophes) and lowercase a word, the form every comparison is made on."""
+    return re.sub(r"[^\w']+", "", word).lower().rstrip()
+
+
+def guess_syllables(word):
+    """
+    Fall back function for estimating number of syllables in case word is not found in CMU dictionary.
+    """
+    # referred from stackoverflow.com/questions/14541303/count-the-number-of-syllables-in-a-word
+    count = 0
+    vowels = "aeiouy"
+    word = word.lower()
+    if word[0] in vowels:
+        count += 1
+    for index in range(1, len(word)):
+        if word[index] in vowels and word[index - 1] not in vowels:
+            count += 1
+    if word.endswith("e"):
+        count -= 1
+    if word.endswith("le"):
+        count += 1
+    if count == 0:
+        count += 1
+    return count
+
+
+def _load_guess_cache() -> dict:
+    global _guess_cache
+
+    if _guess_cache is None:
+        try:
+            with open(GUESS_CACHE_PATH, "r") as f:
+                # Caches saved before pad words were skipped have them
+                _guess_cache = {word: count for word, count in json.load(f).items() if not PAD_WORD.fullmatch(word)}
+        except (OSError, ValueError):
+            _guess_cache = {}
+
+    return _guess_cache
+
+
+def save_guess_cache():
+    """Persist syllable guesses for out-of-dictionary words, if any were added since the last save."""
+    global _guess_cache_dirty
+
+    if not _guess_cache_dirty:
+        return
+
+    try:
+        # Every alignment worker process saves its guesses, each through a temporary file of its own
+        write_json_atomic(GUESS_CACHE_PATH, _guess_cache)
+        _guess_cache_dirty = False
+    except OSError as e:
+        print(e, "could not write syllable guess cache")
+
+
+def _cached_guess(word: str) -> int:
+    global _guess_cache_dirty
+
+    if PAD_WORD.fullmatch(word):
+        return guess_syllables(word)
+
+    guesses = _load_guess_cache()
+    if word not in guesses:
+        guesses[word] = guess_syllables(word)
+        _guess_cache_dirty = True
+
+    return guesses[word]
+
+
+@lru_cache(maxsize=SYLLABLE_CACHE_SIZE)
+def _count_normalized(word: str) -> int:
+    if len(word) == 0:
+        return 0
+
+    transcriptions = CMUtranscribe(word)
+    if transcriptions:
+        # Every syllable has exactly one vowel nucleus, and only vowels carry a stress digit in ARPAbet,
+        # so count those directly from the first transcription instead of building Syllable objects
+        vowel_count = sum(1 for phoneme in transcriptions[0].split() if phoneme[-1].isdigit())
+        if vowel_count != 0:
+            return vowel_count
+
+    return _cached_guess(word)
+
+
+def count_syllables(word: str) -> int:
+    """
+    Returns number of syllables in the word, referencing the CMU dictionary, otherwise estimates.
+    """
+    return _count_normalized(normalize_word(word))
@@ -0,0 +1,39 @@
+import glob
+import os
+import sys
+
+import pytest
+
+# The modules live at the root of the repo, next to main.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def fixture_songs() -> list[str]:
+    """
+    Directories of the fixture songs, each with a musixmatch.json and a whisper.json. They're synthetic: lines of
+    random CMU dictionary words, and a transcription of them with words dropped, misheard and shifted in time.
+    """
+    return sorted(glob.glob(os.path.join(FIXTURES, "*", "")))
+
+
+@pytest.fixture(autouse=True)
+def syllable_guess_cache(tmp_path, monkeypatch) -> str:
+    """Keep the syllable guesses a test makes out of the repo, each test starts without any."""
+    import syllables
+
+    path = str(tmp_path / "syllable_guesses.json")
+    monkeypatch.setenv("SYLLABLE_GUESS_CACHE", path)
+    monkeypatch.setattr(syllables, "GUESS_CACHE_PATH", path)
+    monkeypatch.setattr(syllables, "_guess_cache", None)
+    monkeypatch.setattr(syllables, "_guess_cache_dirty", False)
+    # Counts cached in memory would skip the guess cache
+    syllables._count_normalized.cache_clear()
+    return path
+
+
+@pytest.fixture(params=fixture_songs(), ids=lambda path: os.path.basename(os.path.dirname(path)))
+def song(request) -> str:
+    return request.param
@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import lyrics
+from lyrics import LyricsClient, LyricsNotFound
+
+SYNCED = {"error": False, "syncType": "LINE_SYNCED", "lines": [
+    {"startTimeMs": "1000", "words": "hello", "syllables": [], "endTimeMs": "0"}
+]}
+NOT_FOUND = {"error": True, "message": "lyrics for this track is not available on spotify!"}
+
+
+class LyricsAPI:
+    """Local stand-in for the lyrics API, answering with the queued responses first and synced lyrics after."""
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                api.requests.append(parse_qs(urlparse(self.path).query)["trackid"][0])
+                status, body = api.responses.pop(0) if api.responses else (200, SYNCED)
+
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}/".format(self.server.server_port)
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+
+@pytest.fixture
+def api(monkeypatch):
+    # Retry right away
+    monkeypatch.setattr(lyrics, "LYRICS_BACKOFF", 0)
+    api = LyricsAPI()
+    yield api
+    api.server.shutdown()
+
+
+@pytest.fixture
+def client(api, tmp_path) -> LyricsClient:
+    return LyricsClient(api.url, str(tmp_path / "lyrics_cache"), ttl=60, negative_ttl=10, retries=2)
+
+
+def age_cache(client: LyricsClient, track_id: str, seconds: float):
+    """Make the cached entry for track_id look seconds older."""
+    with open(client.cache_path(track_id), "r") as f:
+        entry = json.load(f)
+    entry["fetched"] -= seconds
+    with open(client.cache_path(track_id), "w") as f:
+        json.dump(entry, f)
+
+
+def test_get_caches_lyrics(api, client):
+    assert client.get("track") == SYNCED
+    assert client.get("track") == SYNCED
+    assert api.requests == ["track"]
+    assert os.path.exists(client.cache_path("track"))
+
+
+def test_get_refetches_expired_lyrics(api, client):
+    client.get("track")
+    age_cache(client, "track", 61)
+
+    assert client.get("track") == SYNCED
+    assert api.requests == ["track", "track"]
+
+
+def test_get_remembers_tracks_without_lyrics(api, client):
+    api.responses = [(404, NOT_FOUND)]
+
+    for _ in range(2):
+        with pytest.raises(LyricsNotFound):
+            client.get("missing")
+    assert api.requests == ["missing"]
+
+    # Lyrics get added over time, so the miss expires sooner than lyrics do
+    age_cache(client, "missing", 11)
+    assert client.get("missing") == SYNCED
+
+
+def test_get_raises_for_unsynced_lyrics(api, client):
+    api.responses = [(200, {"error": False, "syncType": "UNSYNCED", "lines": []})]
+
+    with pytest.raises(LyricsNotFound):
+        client.get("unsynced")
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_get_retries_failed_requests(api, client, status):
+    api.responses = [(status, {"error": True}), (status, {"error": True})]
+
+    assert client.get("track") == SYNCED
+    assert len(api.requests) == 3
+
+
+def test_get_raises_once_retries_run_out(api, client):
+    api.responses = [(503, {"error": True})] * 3
+
+    with pytest.raises(lyrics.requests.HTTPError):
+        client.get("track")
+    assert len(api.requests) == 3
+    # A failure isn't a miss, the next job asks again
+    assert not os.path.exists(client.cache_path("track"))
+
+
+def test_get_does_not_retry_answers(api, client):
+    api.responses = [(400, {"error": True})]
+
+    with pytest.raises(lyrics.requests.HTTPError):
+        client.get("track")
+    assert len(api.requests) == 1
@@ -0,0 +1,144 @@
+import json
+import os
+
+import numpy as np
+
+from match_words import (
+    fill_match_table,
+    fill_match_table_numpy,
+    find_line_breaks,
+    get_karaoke_lines,
+    get_musixmatch_timeline,
+    get_whisper_timeline,
+)
+
+
+def load_song(song: str):
+    with open(os.path.join(song, "musixmatch.json"), "r") as m:
+        musixmatch = get_musixmatch_timeline(json.load(m))
+    with open(os.path.join(song, "whisper.json"), "r") as w:
+        whisper = get_whisper_timeline(json.load(w))
+    return musixmatch, whisper
+
+
+def song_line_breaks(musixmatch, whisper) -> list[int]:
+    line_starts = musixmatch.line_indices[:-1]
+    return find_line_breaks(
+        whisper.start.tolist(),
+        whisper.ids.tolist(),
+        musixmatch.start[line_starts].tolist(),
+        musixmatch.ids[line_starts].tolist(),
+    )
+
+
+def karaoke_lines(song: str, lyrics_dir: str, **kwargs) -> list:
+    os.makedirs(lyrics_dir)
+    path = get_karaoke_lines(
+        os.path.join(song, "musixmatch.json"), os.path.join(song, "whisper.json"), lyrics_dir, **kwargs
+    )
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def test_numpy_engine_matches_python_engine(song, tmp_path):
+    python_lines = karaoke_lines(song, str(tmp_path / "python"), engine="python")
+    numpy_lines = karaoke_lines(song, str(tmp_path / "numpy"), engine="numpy")
+
+    assert numpy_lines == python_lines
+
+
+def test_numpy_match_table_matches_python_table(song):
+    musixmatch, whisper = load_song(song)
+    breaks = song_line_breaks(musixmatch, whisper)
+
+    for line_i in range(musixmatch.line_count()):
+        m_line = musixmatch.line(line_i)
+        w_line = slice(breaks[line_i], breaks[line_i + 1])
+        args = (
+            musixmatch.ids[m_line],
+            musixmatch.syllables[m_line],
+            whisper.ids[w_line],
+            whisper.syllables[w_line],
+            m_line.start,
+            w_line.start,
+        )
+
+        python_table = fill_match_table(*[arg.tolist() if isinstance(arg, np.ndarray) else arg for arg in args])
+        numpy_table = fill_match_table_numpy(*args)
+
+        for m_i, row in enumerate(python_table):
+            for w_i, cell in enumerate(row):
+                assert numpy_table[m_i][w_i] == cell, (line_i, m_i, w_i)
+
+
+def test_line_breaks_match_recorded_breaks(song):
+    """Breakpoints recorded with the original search over every whisper word for every line."""
+    musixmatch, whisper = load_song(song)
+    with open(os.path.join(song, "line_breaks.json"), "r") as f:
+        recorded = json.load(f)
+
+    assert song_line_breaks(musixmatch, whisper) == recorded
+
+
+
+def test_song_mode_times_unmatched_lead_in_before_first_match(tmp_path):
+    # Whisper missed the first words of the song and heard something else in their place
+    musixmatch_json = {
+        "lines": [
+            {"startTimeMs": "7000", "words": "Running through the fire baby", "syllables": [], "endTimeMs": "0"},
+            {"startTimeMs": "9500", "words": "go go go now", "syllables": [], "endTimeMs": "0"},
+        ]
+    }
+    whisper_json = [
+        {
+            "words": [
+                {"word": "trumpet", "start": 7.1, "end": 7.6, "score": 0.4},
+                {"word": "go", "start": 9.5, "end": 9.8, "score": 0.9},
+                {"word": "go", "start": 9.9, "end": 10.2, "score": 0.9},
+                {"word": "go", "start": 10.3, "end": 10.6, "score": 0.9},
+                {"word": "now", "start": 10.7, "end": 11.2, "score": 0.9},
+            ]
+        }
+    ]
+    with open(tmp_path / "musixmatch.json", "w") as f:
+        json.dump(musixmatch_json, f)
+    with open(tmp_path / "whisper.json", "w") as f:
+        json.dump(whisper_json, f)
+
+    lines = karaoke_lines(str(tmp_path), str(tmp_path / "lyrics"), mode="song")
+    words = [word for line in lines for word in line]
+
+    assert [word["word"] for word in words[:5]] == ["Running", "through", "the", "fire", "baby"]
+    for word in words:
+        assert word["startTime"] <= word["endTime"], word
+    for word, next_word in zip(words, words[1:]):
+        assert word["startTime"] <= next_word["startTime"], (word, next_word)
+    assert words[4]["endTime"] <= 9500
+
+
+def test_lines_mode_times_missed_first_words_from_whisper(tmp_path):
+    # Whisper missed "you love", its first word is the start of the next line
+    musixmatch_json = {
+        "lines": [
+            {"startTimeMs": "2363", "words": "you love", "syllables": [], "endTimeMs": "0"},
+            {"startTimeMs": "5300", "words": "heart of mine", "syllables": [], "endTimeMs": "0"},
+        ]
+    }
+    whisper_json = [
+        {
+            "words": [
+                {"word": "heart", "start": 5.303, "end": 5.889},
+                {"word": "of", "start": 5.95, "end": 6.1},
+                {"word": "mine", "start": 6.2, "end": 6.8},
+            ]
+        }
+    ]
+    with open(tmp_path / "musixmatch.json", "w") as f:
+        json.dump(musixmatch_json, f)
+    with open(tmp_path / "whisper.json", "w") as f:
+        json.dump(whisper_json, f)
+
+    lines = karaoke_lines(str(tmp_path), str(tmp_path / "lyrics"))
+
+    # "love" is guessed back from whisper's first word, not stretched from the line start musixmatch gives
+    assert lines[0][1] == {"word": "love", "startTime": 4717, "endTime": 5303}
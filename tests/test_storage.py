@@ -0,0 +1,84 @@
+import pytest
+
+# Tests run against an S3 mocked in process, they're skipped where moto isn't installed
+moto = pytest.importorskip("moto")
+
+import boto3
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+
+from storage import find_existing_karaoke, object_exists
+
+BUCKET = "karaoke-test"
+LYRICS_KEY = "song/lyrics.json"
+TRACK_KEY = "song/track.mp3"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def test_object_exists(s3):
+    s3.put_object(Bucket=BUCKET, Key=TRACK_KEY, Body=b"track")
+
+    assert object_exists(s3, BUCKET, TRACK_KEY)
+    assert not object_exists(s3, BUCKET, "song/missing.mp3")
+
+
+def test_object_exists_raises_other_errors(s3):
+    # Not being allowed to look is not the same as the object not being there
+    with Stubber(s3) as stubber:
+        stubber.add_client_error("head_object", service_error_code="AccessDenied", http_status_code=403)
+        with pytest.raises(ClientError):
+            object_exists(s3, BUCKET, TRACK_KEY)
+
+
+def test_find_existing_karaoke(s3):
+    s3.put_object(Bucket=BUCKET, Key=LYRICS_KEY, Body=b'[[{"word": "hi"}]]')
+    s3.put_object(Bucket=BUCKET, Key=TRACK_KEY, Body=b"track")
+
+    url, lyrics = find_existing_karaoke(s3, BUCKET, LYRICS_KEY, TRACK_KEY)
+
+    assert TRACK_KEY in url
+    assert lyrics == '[[{"word": "hi"}]]'
+
+
+def test_find_existing_karaoke_misses_without_track(s3):
+    # The lyrics are uploaded first, without the track the job didn't finish
+    s3.put_object(Bucket=BUCKET, Key=LYRICS_KEY, Body=b"[]")
+
+    assert find_existing_karaoke(s3, BUCKET, LYRICS_KEY, TRACK_KEY) is None
+
+
+def test_find_existing_karaoke_falls_back_to_legacy_track(s3):
+    s3.put_object(Bucket=BUCKET, Key=LYRICS_KEY, Body=b"[]")
+    s3.put_object(Bucket=BUCKET, Key="song/track.wav", Body=b"track")
+
+    url, lyrics = find_existing_karaoke(s3, BUCKET, LYRICS_KEY, TRACK_KEY, ["song/track.wav"])
+
+    assert "song/track.wav" in url
+    assert lyrics == "[]"
+
+
+def test_find_existing_karaoke_prefers_current_track(s3):
+    s3.put_object(Bucket=BUCKET, Key=LYRICS_KEY, Body=b"[]")
+    s3.put_object(Bucket=BUCKET, Key=TRACK_KEY, Body=b"track")
+    s3.put_object(Bucket=BUCKET, Key="song/track.wav", Body=b"track")
+
+    url, _ = find_existing_karaoke(s3, BUCKET, LYRICS_KEY, TRACK_KEY, ["song/track.wav"])
+
+    assert TRACK_KEY in url
+
+
+def test_find_existing_karaoke_raises_other_errors(s3):
+    with Stubber(s3) as stubber:
+        stubber.add_client_error("head_object", service_error_code="SlowDown", http_status_code=503)
+        with pytest.raises(ClientError):
+            find_existing_karaoke(s3, BUCKET, LYRICS_KEY, TRACK_KEY)
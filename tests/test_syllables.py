@@ -0,0 +1,23 @@
+import json
+
+from syllables import count_syllables, guess_syllables, save_guess_cache
+
+
+def test_dictionary_words_count_their_vowels():
+    # The guess gets these wrong, the CMU dictionary's vowel phonemes don't
+    assert guess_syllables("fire") == 1
+    assert count_syllables("fire") == 2
+    assert count_syllables("Everybody,") == 4
+    assert count_syllables("...") == 0
+
+
+def test_guesses_are_saved_except_pad_words(syllable_guess_cache):
+    assert count_syllables("zorblaxian") == guess_syllables("zorblaxian")
+    assert count_syllables("padpadpad") == 3
+    save_guess_cache()
+
+    with open(syllable_guess_cache, "r") as f:
+        guesses = json.load(f)
+
+    assert "zorblaxian" in guesses
+    assert "padpadpad" not in guesses
@@ -0,0 +1,59 @@
+import numpy as np
+
+from vad import SAMPLE_RATE, VAD_GAP_MS, find_sung_regions, join_regions, restore_timestamps
+
+
+def synthetic_stem() -> np.ndarray:
+    """Ten seconds of faint bleed, with a tone sung over 1-3 s and 6-7.5 s."""
+    rng = np.random.default_rng(0)
+    audio = rng.normal(0, 0.001, SAMPLE_RATE * 10).astype(np.float32)
+    for start, end in [(1, 3), (6, 7.5)]:
+        t = np.arange(int(start * SAMPLE_RATE), int(end * SAMPLE_RATE))
+        audio[t] += 0.5 * np.sin(2 * np.pi * 440 * t / SAMPLE_RATE)
+    return audio
+
+
+def test_find_sung_regions_pads_the_singing():
+    regions = find_sung_regions(synthetic_stem(), threshold_db=-40, min_silence_ms=2000, pad_ms=300)
+
+    assert len(regions) == 2
+    for (start, end), (sung_start, sung_end) in zip(regions, [(1, 3), (6, 7.5)]):
+        # Within a frame of the singing plus the padding on either side
+        assert abs(start / SAMPLE_RATE - (sung_start - 0.3)) <= 0.03
+        assert abs(end / SAMPLE_RATE - (sung_end + 0.3)) <= 0.03
+
+
+def test_find_sung_regions_bridges_short_pauses():
+    regions = find_sung_regions(synthetic_stem(), threshold_db=-40, min_silence_ms=5000, pad_ms=300)
+
+    assert len(regions) == 1
+
+
+def test_find_sung_regions_of_silence():
+    # The threshold is relative to the loudest frame, a silent stem is kept whole
+    assert find_sung_regions(np.zeros(SAMPLE_RATE, dtype=np.float32)) == [(0, SAMPLE_RATE)]
+    assert find_sung_regions(np.zeros(0, dtype=np.float32)) == []
+
+
+def test_restore_timestamps_undoes_join_regions():
+    audio = synthetic_stem()
+    regions = [(SAMPLE_RATE * 1, SAMPLE_RATE * 3), (SAMPLE_RATE * 6, SAMPLE_RATE * 15 // 2)]
+    joined, joined_starts, original_starts = join_regions(audio, regions)
+
+    gap = SAMPLE_RATE * VAD_GAP_MS // 1000
+    assert len(joined) == SAMPLE_RATE * 2 + gap + SAMPLE_RATE * 3 // 2
+    assert np.array_equal(joined[SAMPLE_RATE * 2 + gap:], audio[SAMPLE_RATE * 6:SAMPLE_RATE * 15 // 2])
+    assert joined_starts.tolist() == [0, 2 + VAD_GAP_MS / 1000]
+    assert original_starts.tolist() == [1, 6]
+
+    second = 2 + VAD_GAP_MS / 1000
+    segments = [
+        {"start": 0.5, "end": 1.5, "words": [{"word": "one", "start": 0.5, "end": 1.5}]},
+        {"start": second + 0.25, "end": second + 1, "words": [{"word": "two", "start": second + 0.25}]},
+    ]
+    restore_timestamps(segments, joined_starts, original_starts)
+
+    assert segments[0]["start"] == 1.5 and segments[0]["words"][0]["end"] == 2.5
+    assert segments[1]["start"] == 6.25 and segments[1]["end"] == 7
+    # Words whisper couldn't align have no end, they're left without one
+    assert segments[1]["words"][0] == {"word": "two", "start": 6.25}
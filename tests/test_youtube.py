@@ -0,0 +1,80 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from benchmark import serve_fixture
+from youtube import download_range, download_ranges, select_audio_stream
+
+
+def stream(abr, audio_codec):
+    return SimpleNamespace(abr=abr, audio_codec=audio_codec)
+
+
+def test_select_audio_stream_smallest_adequate():
+    streams = [stream("160kbps", "opus"), stream("48kbps", "mp4a.40.5"), stream("128kbps", "mp4a.40.2")]
+
+    assert select_audio_stream(streams, 128) is streams[2]
+
+
+def test_select_audio_stream_prefers_opus_at_the_same_bitrate():
+    streams = [stream("128kbps", "mp4a.40.2"), stream("128kbps", "opus")]
+
+    assert select_audio_stream(streams, 128) is streams[1]
+
+
+def test_select_audio_stream_best_below_target():
+    streams = [stream("50kbps", "opus"), stream("70kbps", "opus"), stream(None, None)]
+
+    assert select_audio_stream(streams, 128) is streams[1]
+
+
+@pytest.fixture
+def data() -> bytes:
+    return os.urandom(256 * 1024)
+
+
+def test_download_range_resumes_cut_off_requests(tmp_path, data, capsys):
+    # Every other request stops halfway, the retry picks up from the last byte written
+    server, url = serve_fixture(data, 64 * 1024 * 1024, fail_every=2)
+    path = str(tmp_path / "audio")
+    with open(path, "wb") as f:
+        f.truncate(len(data))
+
+    try:
+        session = requests.Session()
+        download_range(session, url, path, 0, 999)
+        download_range(session, url, path, 1000, len(data) - 1)
+    finally:
+        server.shutdown()
+
+    assert "Resuming download at byte" in capsys.readouterr().out
+    with open(path, "rb") as f:
+        assert f.read() == data
+
+
+def test_download_range_gives_up_after_retries(tmp_path, data):
+    server, url = serve_fixture(data, 64 * 1024 * 1024, fail_every=1)
+    path = str(tmp_path / "audio")
+    with open(path, "wb") as f:
+        f.truncate(len(data))
+
+    try:
+        with pytest.raises(IOError):
+            download_range(requests.Session(), url, path, 0, len(data) - 1, retries=1)
+    finally:
+        server.shutdown()
+
+
+def test_download_ranges(tmp_path, data):
+    server, url = serve_fixture(data, 64 * 1024 * 1024, fail_every=3)
+    path = str(tmp_path / "audio")
+
+    try:
+        download_ranges(url, path, len(data), parts=4)
+    finally:
+        server.shutdown()
+
+    with open(path, "rb") as f:
+        assert f.read() == data
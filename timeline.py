@@ -0,0 +1,70 @@
+import sys
+import numpy as np
+
+# Stands in for a timestamp that hasn't been assigned yet, serialized as null
+UNSET = -1
+
+
+class WordTimeline:
+    """
+    The words of a song and their timestamps in ms, stored as parallel arrays instead of a dict per word.
+    words holds the interned raw words, ids and syllables come from match_words.tokenize.
+    line_indices are the indices of the words that start each line, plus one more at the end for easy slicing.
+    Slicing the arrays with line() returns views, so lines never copy the underlying data.
+    """
+
+    def __init__(self, words, ids, syllables, start, end, line_indices=None):
+        self.words = np.array([sys.intern(word) for word in words], dtype=object)
+        self.ids = np.asarray(ids, dtype=np.int32)
+        self.syllables = np.asarray(syllables, dtype=np.int32)
+        self.start = np.asarray(start, dtype=np.int32)
+        self.end = np.asarray(end, dtype=np.int32)
+        self.line_indices = list(line_indices) if line_indices is not None else [0, len(self.words)]
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def line_count(self) -> int:
+        return len(self.line_indices) - 1
+
+    def line(self, line_i) -> slice:
+        """Index range of a line, use it to slice any of the arrays."""
+        return slice(self.line_indices[line_i], self.line_indices[line_i + 1])
+
+    def insert(self, index, word, ids, syllables, start, end):
+        """
+        Insert a word before index. This allocates new arrays, so line views taken earlier keep
+        seeing the words as they were. Line indices aren't adjusted.
+        """
+        self.words = np.insert(self.words, index, sys.intern(word))
+        self.ids = np.insert(self.ids, index, ids)
+        self.syllables = np.insert(self.syllables, index, syllables)
+        self.start = np.insert(self.start, index, start)
+        self.end = np.insert(self.end, index, end)
+
+    def delete(self, index):
+        """Delete the word at index. Like insert, earlier views and line indices are left alone."""
+        self.words = np.delete(self.words, index)
+        self.ids = np.delete(self.ids, index)
+        self.syllables = np.delete(self.syllables, index)
+        self.start = np.delete(self.start, index)
+        self.end = np.delete(self.end, index)
+
+    def to_dicts(self, index_range=slice(None)) -> list[dict]:
+        """Words as {"word": str, "startTime": int, "endTime": int}, the shape written to the lyrics json."""
+        return [
+            {
+                "word": word,
+                "startTime": start if start != UNSET else None,
+                "endTime": end if end != UNSET else None,
+            }
+            for word, start, end in zip(
+                self.words[index_range].tolist(),
+                self.start[index_range].tolist(),
+                self.end[index_range].tolist(),
+            )
+        ]
+
+    def to_lines(self) -> list[list[dict]]:
+        """Words as dicts, grouped by line."""
+        return [self.to_dicts(self.line(line_i)) for line_i in range(self.line_count())]
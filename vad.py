@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+
+# Whether get_whisper transcribes only the parts of the vocal stem that have singing in them.
+# Off until `python benchmark.py vad` shows it's faster without losing words
+VAD_GATE = os.environ.get("VAD_GATE", "0") == "1"
+# Frames quieter than this many dB below the loudest frame of the stem count as silence.
+# Spleeter leaves some bleed from the instruments in the vocals, which sits well below the singing
+VAD_THRESHOLD_DB = float(os.environ.get("VAD_THRESHOLD_DB", -40))
+# Only silences at least this long are cut, shorter ones are pauses within a phrase
+VAD_MIN_SILENCE_MS = int(os.environ.get("VAD_MIN_SILENCE_MS", 2000))
+# Audio kept on either side of every sung region, so quiet word onsets and tails aren't clipped
+VAD_PAD_MS = int(os.environ.get("VAD_PAD_MS", 300))
+# Silence put between the sung regions once they're joined, so Whisper doesn't run words from two regions together
+VAD_GAP_MS = 500
+
+SAMPLE_RATE = 16000
+FRAME_MS = 30
+
+
+def find_sung_regions(
+    audio: np.ndarray,
+    threshold_db: float = VAD_THRESHOLD_DB,
+    min_silence_ms: int = VAD_MIN_SILENCE_MS,
+    pad_ms: int = VAD_PAD_MS,
+) -> list[tuple[int, int]]:
+    """
+    Find the parts of a 16 kHz vocal stem that have singing in them from the energy of 30 ms frames.
+    Returns (start, end) sample indices of every region, in order and not overlapping.
+    """
+    frame = SAMPLE_RATE * FRAME_MS // 1000
+    frame_count = len(audio) // frame
+    if frame_count == 0:
+        return [(0, len(audio))] if len(audio) != 0 else []
+
+    rms = np.sqrt(np.mean(np.square(audio[:frame_count * frame].reshape(frame_count, frame)), axis=1))
+    db = 20 * np.log10(rms + 1e-10)
+    voiced = (db > db.max() + threshold_db).astype(np.int8)
+
+    # Starts and ends (exclusive) of every run of voiced frames
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], voiced, [0]])))
+    starts, ends = edges[::2], edges[1::2]
+    if len(starts) == 0:
+        return []
+
+    # Bridge the pauses too short to be worth cutting
+    long_gaps = (starts[1:] - ends[:-1]) * FRAME_MS >= min_silence_ms
+    starts = np.concatenate([starts[:1], starts[1:][long_gaps]])
+    ends = np.concatenate([ends[:-1][long_gaps], ends[-1:]])
+
+    pad = SAMPLE_RATE * pad_ms // 1000
+    regions = []
+    for start, end in zip((starts * frame - pad).clip(0).tolist(), (ends * frame + pad).clip(max=len(audio)).tolist()):
+        if regions and start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+
+    return regions
+
+
+def join_regions(audio: np.ndarray, regions: list[tuple[int, int]]) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Cut the regions out of audio and join them with VAD_GAP_MS of silence between each.
+    Returns the joined audio, and where every region starts in it and in the original audio, in seconds.
+    """
+    gap = np.zeros(SAMPLE_RATE * VAD_GAP_MS // 1000, dtype=audio.dtype)
+    pieces = []
+    joined_starts = []
+    position = 0
+
+    for start, end in regions:
+        if pieces:
+            pieces.append(gap)
+            position += len(gap)
+        joined_starts.append(position)
+        pieces.append(audio[start:end])
+        position += end - start
+
+    original_starts = np.array([start for start, _ in regions]) / SAMPLE_RATE
+    return np.concatenate(pieces), np.array(joined_starts) / SAMPLE_RATE, original_starts
+
+
+def restore_timestamps(segments: list[dict], joined_starts: np.ndarray, original_starts: np.ndarray):
+    """
+    Move the timestamps of WhisperX segments and their words, taken on the joined audio, back to where they
+    are in the original audio. Every timestamp is shifted by the offset of the region it falls in.
+    """
+
+    def restore(time: float) -> float:
+        region = max(np.searchsorted(joined_starts, time, side="right") - 1, 0)
+        return round(float(time - joined_starts[region] + original_starts[region]), 3)
+
+    for segment in segments:
+        for item in [segment] + segment.get("words", []):
+            for key in ("start", "end"):
+                if key in item:
+                    item[key] = restore(item[key])
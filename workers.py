@@ -0,0 +1,195 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Worker processes for the CPU/GPU heavy stages, each one loads its own copy of the Spleeter and WhisperX models
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", 1))
+# Threads for the stages that mostly wait on the network
+IO_WORKERS = int(os.environ.get("IO_WORKERS", 8))
+
+# The stages of the karaoke pipeline in the order a song goes through them, and which pool each runs in.
+# Lyrics are fetched alongside the audio stages since they only need the Spotify ID.
+STAGE_KINDS = {
+    "lookup": "io",
+    "download": "io",
+    "separate": "cpu",
+    "transcribe": "cpu",
+    "lyrics": "io",
+    "align": "cpu",
+    "upload": "io",
+}
+
+# Seconds every no-op sent to the CPU workers at startup takes, so a worker that's already up doesn't take them all
+WARM_UP_POLL_SECONDS = 0.1
+
+
+def get_stage_concurrency(stage: str, pool_size: int) -> int:
+    """
+    How many jobs a stage works on at once, set with <STAGE>_CONCURRENCY (e.g. TRANSCRIBE_CONCURRENCY=1).
+    Defaults to pool_size, the size of the pool the stage runs in.
+    """
+    return int(os.environ.get(stage.upper() + "_CONCURRENCY", pool_size))
+
+
+def worker_pid(delay: float) -> int:
+    """No-op for the CPU workers, returns the ID of the process that ran it."""
+    time.sleep(delay)
+    return os.getpid()
+
+
+class Stage:
+    """
+    One step of the pipeline: a queue of jobs and a fixed number of runners that take jobs off it
+    and execute them in the stage's pool. Runners start with the first job.
+    on_broken_pool is called with the pool if it breaks, e.g. because a worker process was killed.
+    """
+
+    def __init__(self, name: str, pool, concurrency: int, on_broken_pool=None):
+        self.name = name
+        self.pool = pool
+        self.concurrency = concurrency
+        self.on_broken_pool = on_broken_pool
+        self.queue = None
+        self.runners = []
+
+    async def submit(self, func, *args):
+        """Queue func(*args) and wait for its result."""
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+            self.runners = [asyncio.create_task(self.work()) for _ in range(self.concurrency)]
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((func, args, future))
+        return await future
+
+    async def work(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            func, args, future = await self.queue.get()
+            if future.cancelled():
+                self.queue.task_done()
+                continue
+
+            start = time.perf_counter()
+            pool = self.pool
+            try:
+                result = await loop.run_in_executor(pool, func, *args)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                # This job is lost, but the ones after it needn't be
+                if isinstance(e, BrokenProcessPool) and self.on_broken_pool is not None:
+                    self.on_broken_pool(pool)
+            finally:
+                self.queue.task_done()
+
+            print("Stage {} finished in {:.1f}s, {} waiting".format(
+                self.name, time.perf_counter() - start, self.queue.qsize()
+            ))
+
+    def stop(self):
+        for runner in self.runners:
+            runner.cancel()
+
+
+class Workers:
+    """
+    Runs the blocking stages of the karaoke pipeline off the event loop, so the subscription keeps receiving
+    requests while earlier ones are still being processed.
+    Every stage has its own queue and runners, so songs move through the pipeline independently: song N+1 can
+    be downloading while song N is being transcribed, and throughput is bound by the slowest stage rather
+    than the sum of all of them.
+    CPU stages go to a bounded process pool and I/O stages to a thread pool.
+    initializer is called once in every worker process, use it to load models up front, and call start
+    so that happens before the first request. If a worker process dies the CPU pool is replaced.
+    """
+
+    def __init__(self, cpu_workers: int = CPU_WORKERS, io_workers: int = IO_WORKERS, initializer=None):
+        self.cpu_workers = cpu_workers
+        self.initializer = initializer
+        self.cpu_pool = self.make_cpu_pool()
+        self.io_pool = ThreadPoolExecutor(io_workers, thread_name_prefix="io")
+        self.stages = {
+            stage: Stage(stage, self.cpu_pool, get_stage_concurrency(stage, cpu_workers), self.replace_cpu_pool)
+            if kind == "cpu"
+            else Stage(stage, self.io_pool, get_stage_concurrency(stage, io_workers))
+            for stage, kind in STAGE_KINDS.items()
+        }
+
+    def make_cpu_pool(self) -> ProcessPoolExecutor:
+        # Spawn rather than fork, CUDA can't be used in a forked child
+        return ProcessPoolExecutor(
+            self.cpu_workers, mp_context=multiprocessing.get_context("spawn"), initializer=self.initializer
+        )
+
+    def start(self):
+        """
+        Spawn every CPU worker process and wait until each one has run initializer. The pool only spawns
+        processes as work is submitted, so otherwise the first requests would wait for the models to load.
+        Raises BrokenProcessPool if initializer fails.
+        """
+        pids = set()
+        while len(pids) < self.cpu_workers:
+            calls = [self.cpu_pool.submit(worker_pid, WARM_UP_POLL_SECONDS) for _ in range(self.cpu_workers)]
+            pids.update(call.result() for call in calls)
+
+    def replace_cpu_pool(self, broken: ProcessPoolExecutor):
+        """Swap the broken CPU pool for a new one, once however many stages saw it break."""
+        if broken is not self.cpu_pool:
+            return
+
+        print("A CPU worker process died, starting new workers")
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.cpu_pool = self.make_cpu_pool()
+        for stage in self.stages.values():
+            if STAGE_KINDS[stage.name] == "cpu":
+                stage.pool = self.cpu_pool
+
+        # Spawn the new workers now, so they load their models before the next job reaches them
+        for _ in range(self.cpu_workers):
+            self.cpu_pool.submit(worker_pid, 0)
+
+    async def run(self, stage: str, func, *args):
+        """Queue func(*args) on stage and return its result once one of the stage's runners has executed it."""
+        return await self.stages[stage].submit(func, *args)
+
+    def shutdown(self):
+        for stage in self.stages.values():
+            stage.stop()
+
+        self.cpu_pool.shutdown(cancel_futures=True)
+        self.io_pool.shutdown(cancel_futures=True)
+
+
+class SingleFlight:
+    """
+    Shares one computation between every caller asking for the same key while it's in flight,
+    e.g. several users requesting the same track at once. Counts how many calls were coalesced.
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, make_coroutine):
+        """Await make_coroutine() for key, or the call already running for it."""
+        self.calls += 1
+        task = self.in_flight.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(make_coroutine())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+            print("Coalesced request for {} ({} of {} requests coalesced)".format(key, self.coalesced, self.calls))
+
+        # Shielded so a cancelled caller doesn't cancel the work for everyone else waiting on it
+        return await asyncio.shield(task)
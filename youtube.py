@@ -0,0 +1,132 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Search results whose metadata is fetched at once when looking for the song's video
+YOUTUBE_SEARCH_WORKERS = int(os.environ.get("YOUTUBE_SEARCH_WORKERS", 4))
+
+
+def search_youtube(query: str) -> list:
+    """
+    Default search backend: YouTube's results for query, best first, as pytube YouTube objects.
+    Any function returning objects with a length in seconds and streams like pytube's can stand in for it.
+    """
+    # Imported here so other backends work without pytube installed
+    from pytube import Search
+
+    return Search(query).results
+
+
+def find_video(title, length: int, MAX_TIME_DIF: int = 2, search=search_youtube, workers: int = YOUTUBE_SEARCH_WORKERS):
+    """
+    Return the first search result for title whose duration is within MAX_TIME_DIF seconds of length,
+    or None if none is. Reading a result's length can take a network round trip each, so up to workers
+    results are looked up at once, still in the order search ranked them, and the rest are cancelled once
+    one matches.
+    """
+    results = search(title)
+
+    pool = ThreadPoolExecutor(max(workers, 1), thread_name_prefix="search")
+    lengths = [pool.submit(lambda video: video.length, video) for video in results]
+
+    try:
+        for video, video_length in zip(results, lengths):
+            try:
+                if abs(video_length.result() - length) < MAX_TIME_DIF:
+                    return video
+            except Exception as e:
+                # e.g. an age restricted or removed video, the next result may still do
+                print("Skipping search result:", e)
+    finally:
+        # Don't wait on lookups still running for results that are no longer needed
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return None
+
+
+# Audio bitrate in kbps that's enough for separating 2 stems, smaller streams are preferred as long as they reach it
+AUDIO_TARGET_KBPS = int(os.environ.get("AUDIO_TARGET_KBPS", 128))
+# Range requests a download is split into, fetched at once
+DOWNLOAD_PARTS = int(os.environ.get("DOWNLOAD_PARTS", 4))
+# Times a part is resumed from where it stopped after a failed request
+DOWNLOAD_RETRIES = int(os.environ.get("DOWNLOAD_RETRIES", 3))
+# Seconds to wait for the server to respond or send more data
+DOWNLOAD_TIMEOUT = 30
+
+# Opus sounds as good as AAC at a lower bitrate, so at the same bitrate it's preferred
+CODEC_PREFERENCE = {"opus": 0, "mp4a": 1}
+
+
+def get_kbps(stream) -> int:
+    """A pytube stream's average audio bitrate, e.g. 160 for "160kbps"."""
+    return int(stream.abr.rstrip("kbps")) if stream.abr else 0
+
+
+def select_audio_stream(streams, target_kbps: int = AUDIO_TARGET_KBPS):
+    """
+    The smallest audio stream at or above target_kbps, the best codec of those at the same bitrate,
+    or the highest bitrate stream if none reach the target.
+    """
+    def rank(stream):
+        codec = (stream.audio_codec or "").split(".")[0]
+        return get_kbps(stream), CODEC_PREFERENCE.get(codec, len(CODEC_PREFERENCE))
+
+    ranked = sorted(streams, key=rank)
+    adequate = [stream for stream in ranked if get_kbps(stream) >= target_kbps]
+    return adequate[0] if adequate else ranked[-1]
+
+
+def download_range(session, url: str, path: str, start: int, end: int, retries: int = DOWNLOAD_RETRIES):
+    """
+    Download bytes start to end (inclusive) of url into the same place in the file at path. If the connection
+    fails, the request is resumed from the last byte received, up to retries times.
+    """
+    with open(path, "r+b") as f:
+        f.seek(start)
+        position = start
+
+        for attempt in range(retries + 1):
+            try:
+                with session.get(
+                    url, headers={"Range": "bytes={}-{}".format(position, end)}, stream=True, timeout=DOWNLOAD_TIMEOUT
+                ) as res:
+                    res.raise_for_status()
+                    if res.status_code != 206:
+                        raise ValueError("Server ignored the range request for " + url)
+
+                    for block in res.iter_content(1 << 16):
+                        f.write(block)
+                        position += len(block)
+
+                if position > end:
+                    return
+                raise IOError("Connection closed {} bytes early".format(end + 1 - position))
+            except IOError as e:
+                if attempt == retries:
+                    raise
+                print("Resuming download at byte {} after: {}".format(position, e))
+
+
+def download_ranges(url: str, path: str, size: int, parts: int = DOWNLOAD_PARTS, session=None):
+    """Download url, size bytes long, to path as parts range requests made at once."""
+    session = session or requests.Session()
+    part_size = max(-(-size // max(parts, 1)), 1)
+
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+    with ThreadPoolExecutor(max(parts, 1), thread_name_prefix="download") as pool:
+        downloads = [
+            pool.submit(download_range, session, url, path, start, min(start + part_size, size) - 1)
+            for start in range(0, size, part_size)
+        ]
+        for part in downloads:
+            part.result()
+
+
+def download_audio(video, path: str, target_kbps: int = AUDIO_TARGET_KBPS, parts: int = DOWNLOAD_PARTS):
+    """Download the smallest adequate audio stream of a pytube video to path."""
+    stream = select_audio_stream(video.streams.filter(only_audio=True), target_kbps)
+    print("Downloading {} {} stream ({:.1f} MB)".format(stream.abr, stream.audio_codec, stream.filesize / 1e6))
+    download_ranges(stream.url, path, stream.filesize, parts)